@@ -0,0 +1,414 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Optional
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+
+from storage import Storage
+from repository import MemoryRepository, migrate_pickle_to_sqlite
+
+# Нагрузочный прогон: бот запускается отдельным процессом с TELEGRAM_API_URL,
+# указывающим на заглушку Bot API в этом процессе, и получает на вебхук
+# синтетические обновления. Задержка считается от отправки обновления до
+# первого обращения бота к Bot API с chat_id этого пользователя.
+#
+#   python bench.py --ankets 10000 --scenarios add,view,paginate,view_callback,search,admin --output bench_output.txt
+#
+# Результат — JSON в stdout (и в --output, если указан).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:bench"
+ADMIN_ID = 1340811422
+SCENARIOS = ('add', 'view', 'paginate', 'view_callback', 'search', 'admin')
+WORDS = ("опрос", "учёба", "работа", "спорт", "музыка", "кино", "игры", "книги",
+         "путешествия", "психология", "здоровье", "питание", "мода", "техника")
+# Пользователи, которые шлют обновления, не пересекаются с авторами анкет
+USER_BASE = 10 ** 9
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1] * 1000, 2)}
+
+
+def peak_rss_kb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# ====== Данные ======
+def seed(directory: str, count: int, backend: str):
+    snapshot = os.path.join(directory, "bot_data.pkl")
+    journal = os.path.join(directory, "bot_data.journal")
+    repo = MemoryRepository(Storage(snapshot, journal, compact_every=10 ** 9), batch_size=10 ** 4)
+    rng = random.Random(count)
+    for user_id in range(1, count + 1):
+        comment = " ".join(rng.sample(WORDS, 3)) + f" №{user_id}"
+        repo.add_anket(user_id, f"https://forms.gle/bench{user_id}", comment)
+    repo.close()
+    if backend == 'sqlite':
+        migrate_pickle_to_sqlite(snapshot, journal, os.path.join(directory, "bot_data.db"))
+
+
+# ====== Заглушка Bot API ======
+class FakeBotApi:
+    def __init__(self):
+        self.calls = 0
+        self.webhook_set = None
+        self.webhook_updates = None
+        self._waiters = {}
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    def _resolve(self, chat_id, params: dict):
+        waiters = self._waiters.get(chat_id)
+        while waiters:
+            future = waiters.pop(0)
+            if not future.done():
+                future.set_result((time.perf_counter(), params))
+                break
+        if waiters == []:
+            del self._waiters[chat_id]
+
+    @staticmethod
+    def _params(body: bytes, content_type: str) -> dict:
+        if 'json' in content_type:
+            return json.loads(body or b"{}")
+        if 'multipart' in content_type:
+            return {name.decode(): value.decode() for name, value in
+                    re.findall(rb'name="(\w+)"\r\n\r\n([^\r]*)\r\n', body)}
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def _result(self, method: str, params: dict):
+        chat_id = str(params.get('chat_id', 0))
+        chat = {"id": int(chat_id) if chat_id.lstrip('-').isdigit() else 0, "type": "private"}
+        if method == 'getMe':
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            return {"message_id": self.calls, "date": int(time.time()), "chat": chat, "text": "ok"}
+        if method == 'getChat':
+            user_id = int(params.get('chat_id', 0))
+            return {"id": user_id, "type": "private", "username": f"user{user_id}"}
+        if method == 'getWebhookInfo':
+            return {"url": self.webhook_set or "", "has_custom_certificate": False, "pending_update_count": 0,
+                    "allowed_updates": self.webhook_updates}
+        if method == 'setWebhook':
+            self.webhook_set = params.get('url')
+            allowed = params.get('allowed_updates')
+            self.webhook_updates = json.loads(allowed) if isinstance(allowed, str) else allowed
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get('body', b"")
+            if not message.get('more_body'):
+                break
+        headers = dict(scope['headers'])
+        method = scope['path'].rsplit('/', 1)[-1]
+        params = self._params(body, headers.get(b'content-type', b"").decode())
+        self.calls += 1
+        result = self._result(method, params)
+        if 'chat_id' in params:
+            try:
+                self._resolve(int(params['chat_id']), params)
+            except ValueError:
+                pass
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+# ====== Обновления ======
+class Updates:
+    def __init__(self):
+        self.next_id = 0
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "bench", "username": f"bench{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        self.next_id += 1
+        entities = []
+        if text.startswith('/'):
+            entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": self.next_id, "message": {
+            "message_id": self.next_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id),
+            "text": text, "entities": entities}}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        self.next_id += 1
+        return {"update_id": self.next_id, "callback_query": {
+            "id": str(self.next_id), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": {"message_id": 1, "date": int(time.time()),
+                                      "chat": {"id": user_id, "type": "private"}, "text": "ok"}}}
+
+
+# ====== Прогон ======
+class Bench:
+    def __init__(self, args, template: str):
+        self.args = args
+        self.template = template
+        self.api = FakeBotApi()
+        self.api_port = free_port()
+        self.updates = Updates()
+        self.client = None
+        self.url = None
+
+    async def start_app(self, workdir: str):
+        for name in os.listdir(self.template):
+            shutil.copy(os.path.join(self.template, name), workdir)
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ,
+                   TELEGRAM_TOKEN=TOKEN,
+                   WEBHOOK_URL=f"{self.url}/{TOKEN}",
+                   TELEGRAM_API_URL=f"http://127.0.0.1:{self.api_port}/bot",
+                   PORT=str(port),
+                   SERVER_MODE=self.args.server_mode,
+                   STORAGE_BACKEND=self.args.backend,
+                   # Лимиты Telegram к заглушке не относятся
+                   OUTBOUND_GLOBAL_RATE="1000000",
+                   OUTBOUND_CHAT_RATE="1000000",
+                   OUTBOUND_CHANNEL_PER_MINUTE="1000000",
+                   # Сценарии шлют обновления быстрее живого пользователя
+                   FLOOD_COMMAND_RATE="0",
+                   FLOOD_CALLBACK_RATE="0",
+                   FLOOD_TEXT_RATE="0")
+        started = time.perf_counter()
+        listening = None
+        process = subprocess.Popen([sys.executable, os.path.join(HERE, "main.py")], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = started + self.args.startup_timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Бот завершился при запуске, см. {workdir}/bot.log")
+            try:
+                response = await self.client.get(f"{self.url}/health")
+                if response.status_code == 200 and listening is None:
+                    listening = time.perf_counter() - started
+                if response.status_code == 200 and response.json().get('status') == 'ok':
+                    return process, listening, time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+        process.kill()
+        raise RuntimeError(f"Бот не запустился за {self.args.startup_timeout} с, см. {workdir}/bot.log")
+
+    async def stop_app(self, process) -> float:
+        started = time.perf_counter()
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, process.wait, 60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        return time.perf_counter() - started
+
+    async def request(self, user_id: int, update: dict, stats: dict) -> Optional[dict]:
+        # Один шаг: отправить обновление и дождаться ответа бота этому
+        # пользователю; возвращает параметры этого ответа
+        reply = self.api.expect(user_id)
+        sent = time.perf_counter()
+        try:
+            response = await self.client.post(f"{self.url}/{TOKEN}", json=update)
+            stats['ingress'].append(time.perf_counter() - sent)
+            if response.status_code != 200:
+                raise RuntimeError(response.status_code)
+            answered, params = await asyncio.wait_for(reply, self.args.reply_timeout)
+            stats['latency'].append(answered - sent)
+            return params
+        except Exception:
+            reply.cancel()
+            stats['errors'] += 1
+            return None
+
+    @staticmethod
+    def button(params: Optional[dict], text: str) -> Optional[str]:
+        # callback_data кнопки с таким текстом в клавиатуре ответа
+        markup = (params or {}).get('reply_markup')
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        for row in (markup or {}).get('inline_keyboard', ()):
+            for button in row:
+                if button.get('text') == text:
+                    return button.get('callback_data')
+        return None
+
+    async def user_session(self, scenario: str, user_id: int, stats: dict, rng: random.Random):
+        if scenario == 'add':
+            await self.request(user_id, self.updates.message(user_id, "/add"), stats)
+            await self.request(user_id, self.updates.message(
+                user_id, f"https://forms.gle/new{user_id} {' '.join(rng.sample(WORDS, 2))}"), stats)
+        elif scenario == 'view':
+            await self.request(user_id, self.updates.message(user_id, "/view"), stats)
+        elif scenario == 'paginate':
+            # Вперёд по кнопке «Далее →» и столько же обратно по «← Назад»
+            reply = await self.request(user_id, self.updates.message(user_id, "/view"), stats)
+            for label in ("Далее →",) * self.args.pages + ("← Назад",) * self.args.pages:
+                data = self.button(reply, label)
+                if data is None:
+                    break
+                reply = await self.request(user_id, self.updates.callback(user_id, data), stats)
+        elif scenario == 'view_callback':
+            for _ in range(self.args.pages):
+                anket_id = rng.randint(1, max(1, self.args.ankets))
+                await self.request(user_id, self.updates.callback(user_id, f"view_{anket_id}"), stats)
+        elif scenario == 'search':
+            # Два слова из комментариев, второе — началом слова, и переход дальше
+            first, second = rng.sample(WORDS, 2)
+            reply = await self.request(user_id, self.updates.message(user_id, f"/search {first} {second[:3]}"), stats)
+            for _ in range(self.args.pages):
+                data = self.button(reply, "Далее →")
+                if data is None:
+                    break
+                reply = await self.request(user_id, self.updates.callback(user_id, data), stats)
+        elif scenario == 'admin':
+            # Выгрузка каталога приходит одним файлом
+            await self.request(ADMIN_ID, self.updates.callback(ADMIN_ID, "admin_view_all"), stats)
+
+    async def run_scenario(self, scenario: str) -> dict:
+        workdir = tempfile.mkdtemp(prefix=f"bench-{scenario}-")
+        process, listening, startup = await self.start_app(workdir)
+        stats = {'latency': [], 'ingress': [], 'errors': 0}
+        users = self.args.admin_requests if scenario == 'admin' else self.args.users
+        concurrency = 1 if scenario == 'admin' else self.args.concurrency
+        rng = random.Random(scenario)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def session(index: int):
+            async with semaphore:
+                await self.user_session(scenario, USER_BASE + index, stats, rng)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(session(index) for index in range(users)))
+        elapsed = time.perf_counter() - started
+        rss = peak_rss_kb(process.pid)
+        shutdown = await self.stop_app(process)
+        if not self.args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return {
+            "users": users,
+            "concurrency": concurrency,
+            "requests": len(stats['latency']) + stats['errors'],
+            "errors": stats['errors'],
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(stats['latency']) / elapsed, 1) if elapsed else None,
+            "latency_ms": percentiles(stats['latency']),
+            "ingress_ms": percentiles(stats['ingress']),
+            "peak_rss_kb": rss,
+            "listen_s": round(listening, 3),
+            "startup_s": round(startup, 3),
+            "shutdown_s": round(shutdown, 3)
+        }
+
+    async def run(self) -> dict:
+        config = uvicorn.Config(self.api, host="127.0.0.1", port=self.api_port,
+                                log_level="warning", access_log=False, lifespan="off")
+        server = uvicorn.Server(config)
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        results = {}
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=self.args.reply_timeout) as self.client:
+                for scenario in self.args.scenarios:
+                    results[scenario] = await self.run_scenario(scenario)
+                    print(f"{scenario}: {json.dumps(results[scenario], ensure_ascii=False)}", file=sys.stderr)
+        finally:
+            server.should_exit = True
+            await server_task
+        return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против заглушки Bot API")
+    parser.add_argument("--ankets", type=int, default=1000, help="анкет в исходных данных (1k–100k)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"через запятую из: {', '.join(SCENARIOS)}")
+    parser.add_argument("--users", type=int, default=200, help="пользователей в сценарии")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно активных пользователей")
+    parser.add_argument("--pages", type=int, default=5, help="шагов на пользователя в paginate/view_callback/search")
+    parser.add_argument("--admin-requests", type=int, default=3, help="выгрузок каталога в сценарии admin")
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--server-mode", choices=("asgi", "flask"), default="asgi")
+    parser.add_argument("--reply-timeout", type=float, default=60)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--output", help="куда дополнительно записать JSON")
+    parser.add_argument("--keep", action="store_true", help="не удалять рабочие каталоги (bot.log и данные)")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    template = tempfile.mkdtemp(prefix="bench-data-")
+    try:
+        started = time.perf_counter()
+        seed(template, args.ankets, args.backend)
+        print(f"Данные подготовлены за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+        if args.backend == 'sqlite':
+            for name in ("bot_data.pkl", "bot_data.journal"):
+                if os.path.exists(os.path.join(template, name)):
+                    os.remove(os.path.join(template, name))
+        results = asyncio.run(Bench(args, template).run())
+    finally:
+        shutil.rmtree(template, ignore_errors=True)
+
+    report = {
+        "ankets": args.ankets,
+        "backend": args.backend,
+        "server_mode": args.server_mode,
+        "scenarios": results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
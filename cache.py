@@ -0,0 +1,146 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Пользователь недоступен (удалён, заблокировал бота и т.п.)
+UNAVAILABLE = None
+
+
+# ====== Кэш username'ов ======
+# user_id -> (username, момент устаревания) в порядке последнего обращения.
+# Пустая строка — у пользователя нет username, UNAVAILABLE — get_chat упал;
+# такие записи живут negative_ttl, чтобы не долбить API повторно.
+# Заполняется и из входящих обновлений, и по промахам через get_chat,
+# которые разрешаются параллельно, но не больше concurrency за раз.
+class ChatCache:
+    def __init__(self, ttl: float = 3600, maxsize: int = 10000,
+                 concurrency: int = 10, negative_ttl: float = 300):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._semaphore = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def remember(self, user_id: int, username: Optional[str], ttl: Optional[float] = None):
+        if ttl is None:
+            ttl = self.ttl if username is not UNAVAILABLE else self.negative_ttl
+        self._entries[user_id] = (username, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def lookup(self, user_id: int):
+        # (найдено, username) без обращения к API
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        username, expires = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return False, None
+        self._entries.move_to_end(user_id)
+        return True, username
+
+    async def resolve(self, bot, user_id: int) -> Optional[str]:
+        found, username = self.lookup(user_id)
+        if found:
+            self.hits += 1
+            return username
+        self.misses += 1
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                chat = await bot.get_chat(user_id)
+                username = chat.username or ""
+            except Exception as e:
+                logger.warning(f"Не удалось получить чат {user_id}: {e}")
+                username = UNAVAILABLE
+        self.remember(user_id, username)
+        return username
+
+    async def resolve_many(self, bot, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        unique = list(dict.fromkeys(user_ids))
+        usernames = await asyncio.gather(*(self.resolve(bot, user_id) for user_id in unique))
+        return dict(zip(unique, usernames))
+
+    def cached_many(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        # Только то, что уже есть в кэше, без запросов к API
+        usernames = {}
+        for user_id in user_ids:
+            found, username = self.lookup(user_id)
+            if found:
+                self.hits += 1
+                usernames[user_id] = username
+            else:
+                self.misses += 1
+        return usernames
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else None
+        }
+
+
+# ====== Снимки страниц ======
+# Последние показанные пользователю страницы каталога по callback_data
+# кнопки, которая к ним ведёт. Переход «назад/вперёд» по уже открытым
+# страницам не трогает репозиторий, пока снимок моложе ttl. Пользователи
+# вытесняются по LRU, у каждого хранится не больше per_user страниц.
+class PageCache:
+    def __init__(self, ttl: float = 60, maxsize: int = 5000, per_user: int = 10):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.per_user = per_user
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+
+    def get(self, user_id: int, key: str):
+        pages = self._users.get(user_id)
+        entry = pages.get(key) if pages else None
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._users.move_to_end(user_id)
+        return entry[0]
+
+    def put(self, user_id: int, key: str, page):
+        if self.ttl <= 0:
+            return
+        pages = self._users.get(user_id)
+        if pages is None:
+            pages = self._users[user_id] = OrderedDict()
+        pages[key] = (page, time.monotonic() + self.ttl)
+        pages.move_to_end(key)
+        while len(pages) > self.per_user:
+            pages.popitem(last=False)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        # Без user_id — сбросить всё (анкета удалена из каталога)
+        if user_id is None:
+            self._users.clear()
+        else:
+            self._users.pop(user_id, None)
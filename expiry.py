@@ -0,0 +1,115 @@
+import time
+import heapq
+import asyncio
+import logging
+from typing import Awaitable, Callable, List
+
+from storage import Anket
+
+logger = logging.getLogger(__name__)
+
+
+# ====== Срок жизни анкет ======
+# Min-куча (момент истечения, id анкеты). Задача спит до ближайшего
+# истечения, снимает с вершины все наступившие, удаляет их из репозитория
+# пачками по batch_size и передаёт удалённые в on_expired (посты в канале
+# и т.п.). Анкеты, удалённые раньше срока, остаются в куче, пока до них не
+# дойдёт очередь; когда таких становится больше живых, куча пересобирается
+# по репозиторию, так что её размер ограничен числом живых анкет.
+class ExpirySweeper:
+    def __init__(self, repo, ttl: float, on_expired: Callable[[List[Anket]], Awaitable[None]],
+                 batch_size: int = 100, max_sleep: float = 3600):
+        self.repo = repo
+        self.ttl = ttl
+        self.on_expired = on_expired
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self.expired = 0
+        self._heap = []
+        self._wake = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def load(self, page_size: int = 1000) -> int:
+        # Все живые анкеты по курсору id; id растут вместе со временем
+        # создания, так что список почти упорядочен и heapify дешёвый
+        heap = []
+        after_id = 0
+        while True:
+            ankets = self.repo.list_ankets(limit=page_size, after_id=after_id)
+            if not ankets:
+                break
+            heap.extend((anket.time + self.ttl, anket.id) for anket in ankets)
+            after_id = ankets[-1].id
+        heapq.heapify(heap)
+        self._heap = heap
+        return len(heap)
+
+    def schedule(self, anket: Anket):
+        entry = (anket.time + self.ttl, anket.id)
+        heapq.heappush(self._heap, entry)
+        if self._wake is not None and self._heap[0] == entry:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def sweep(self, now: float) -> List[Anket]:
+        # Одна пачка наступивших истечений
+        ids = []
+        while self._heap and self._heap[0][0] <= now and len(ids) < self.batch_size:
+            ids.append(heapq.heappop(self._heap)[1])
+        if not ids:
+            return []
+        try:
+            expired = self.repo.expire_ankets(ids)
+        except Exception:
+            # Вернём в кучу, попробуем на следующем проходе
+            for anket_id in ids:
+                heapq.heappush(self._heap, (now, anket_id))
+            raise
+        self.expired += len(expired)
+        return expired
+
+    async def _run(self):
+        while True:
+            try:
+                expired = self.sweep(time.time())
+            except Exception as e:
+                logger.error(f"Ошибка удаления истёкших анкет: {e}")
+                await asyncio.sleep(min(60, self.max_sleep))
+                continue
+            if expired:
+                logger.info(f"Удалено истёкших анкет: {len(expired)}")
+                try:
+                    await self.on_expired(expired)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки истёкших анкет: {e}")
+                # Следующая пачка — после того, как обработчики успеют поработать
+                await asyncio.sleep(0)
+                continue
+
+            if len(self._heap) > 2 * self.repo.count_ankets() + 64:
+                self.load()
+            wait = self.max_sleep
+            if self._heap:
+                wait = min(wait, max(0.0, self._heap[0][0] - time.time()))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,137 @@
+import io
+import csv
+import json
+import time
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from cache import UNAVAILABLE
+from storage import Anket
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ('id', 'user_id', 'username', 'url', 'comment', 'created_at')
+
+
+# ====== Параметры выгрузки ======
+# /export [csv|jsonl] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [user=ID] [resolve];
+# to включает весь указанный день. Без resolve username'ы берутся только из
+# кэша (на 100k анкет get_chat по каждой заняло бы минуты), с resolve
+# промахи запрашиваются через API. Неверный аргумент — ValueError с текстом
+# для администратора.
+class ExportQuery:
+    def __init__(self, fmt: str = 'csv', since: Optional[float] = None,
+                 until: Optional[float] = None, owner: Optional[int] = None,
+                 resolve: bool = False):
+        self.fmt = fmt
+        self.since = since
+        self.until = until
+        self.owner = owner
+        self.resolve = resolve
+
+    @classmethod
+    def parse(cls, args: Iterable[str]) -> 'ExportQuery':
+        query = cls()
+        for arg in args:
+            key, _, value = arg.partition('=')
+            key = key.lower()
+            try:
+                if not value and key in EXPORT_FORMATS:
+                    query.fmt = key
+                elif not value and key == 'resolve':
+                    query.resolve = True
+                elif key == 'from':
+                    query.since = datetime.strptime(value, '%Y-%m-%d').timestamp()
+                elif key == 'to':
+                    query.until = (datetime.strptime(value, '%Y-%m-%d') + timedelta(days=1)).timestamp()
+                elif key == 'user':
+                    query.owner = int(value)
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"Непонятный параметр: {arg}") from None
+        return query
+
+    def match(self, anket: Anket) -> bool:
+        if self.owner is not None and anket.user_id != self.owner:
+            return False
+        if self.since is not None and anket.time < self.since:
+            return False
+        if self.until is not None and anket.time >= self.until:
+            return False
+        return True
+
+    def filename(self, part: Optional[int] = None) -> str:
+        suffix = "" if part is None else f"-{part}"
+        return f"ankets-{time.strftime('%Y%m%d-%H%M%S')}{suffix}.{self.fmt}"
+
+
+# ====== Выгрузка ======
+# Каталог читается пачками по курсору id, username'ы берутся по пачке
+# через usernames (нет в ответе — пустое поле), строки пишутся сразу в
+# байтовый файл. Файл держится в памяти до spool_bytes, дальше уходит во
+# временный файл на диске. Отправка в Telegram читает файл в память
+# целиком, поэтому выгрузка режется на части не больше max_bytes (у CSV
+# в каждой свой заголовок), и память ограничена размером одной части.
+# Части отдаются по мере готовности: (файл в начале, число анкет в нём);
+# закрывает файл вызывающий. Между пачками управление отдаётся event loop,
+# чтобы большой каталог не задерживал остальные обновления.
+async def export_ankets(repo, query: ExportQuery,
+                        usernames: Callable[[Iterable[int]], Awaitable[Dict[int, Optional[str]]]],
+                        batch_size: int = 1000, spool_bytes: int = 1024 * 1024,
+                        max_bytes: int = 20 * 1024 * 1024):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = b""
+    if query.fmt == 'csv':
+        # BOM, чтобы Excel открыл кириллицу без выбора кодировки
+        buffer.write('\ufeff')
+        writer.writerow(EXPORT_FIELDS)
+        header = buffer.getvalue().encode('utf-8')
+
+    output = None
+    size = count = 0
+    after_id = 0
+    while True:
+        if query.owner is not None:
+            # У пользователя не больше одной анкеты
+            anket = repo.get_user_anket(query.owner) if after_id == 0 else None
+            ankets = [anket] if anket else []
+        else:
+            ankets = repo.list_ankets(limit=batch_size, after_id=after_id)
+        if not ankets:
+            break
+        after_id = ankets[-1].id
+
+        ankets = [anket for anket in ankets if query.match(anket)]
+        names = await usernames(anket.user_id for anket in ankets)
+        for anket in ankets:
+            username = names.get(anket.user_id)
+            row = (anket.id, anket.user_id, "" if username is UNAVAILABLE else username,
+                   anket.url, anket.comment,
+                   datetime.fromtimestamp(anket.time).isoformat(timespec='seconds'))
+            buffer.seek(0)
+            buffer.truncate()
+            if query.fmt == 'csv':
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + "\n")
+            line = buffer.getvalue().encode('utf-8')
+
+            if output is not None and size + len(line) > max_bytes:
+                output.seek(0)
+                yield output, count
+                output = None
+            if output is None:
+                output = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+                output.write(header)
+                size, count = len(header), 0
+            output.write(line)
+            size += len(line)
+            count += 1
+        await asyncio.sleep(0)
+
+    if output is not None:
+        output.seek(0)
+        yield output, count
@@ -0,0 +1,114 @@
+import sqlite3
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+from ratelimit import KeyedTokenBuckets
+
+
+# ====== Повторные доставки ======
+# Telegram повторяет доставку вебхука, если не дождался ответа, и то же
+# обновление приходит второй раз. Помним последние size update_id: кольцевой
+# буфер задаёт порядок вытеснения, множество — проверку за O(1).
+class UpdateDedup:
+    def __init__(self, size: int = 10000):
+        self.size = size
+        self.duplicates = 0
+        self._ring = array('q', bytes(8 * size))
+        self._pos = 0
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def check(self, update_id: Optional[int]) -> bool:
+        # True — обновление новое и его надо обработать
+        if not self.size or update_id is None:
+            return True
+        if update_id in self._seen:
+            self.duplicates += 1
+            return False
+        if len(self._seen) >= self.size:
+            self._seen.discard(self._ring[self._pos])
+        self._ring[self._pos] = update_id
+        self._pos = (self._pos + 1) % self.size
+        self._seen.add(update_id)
+        return True
+
+
+# Тот же фильтр для нескольких процессов: повтор может прийти в другой
+# воркер, поэтому update_id записываются в общую таблицу SQLite. Вставка
+# по первичному ключу атомарна; старые id удаляются пачкой раз в prune_every
+# вставок относительно последнего пришедшего.
+class SqliteUpdateDedup:
+    def __init__(self, path: str, size: int = 10000, prune_every: int = 1000):
+        self.size = size
+        self.prune_every = prune_every
+        self.duplicates = 0
+        self._inserted = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY)")
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM seen_updates").fetchone()[0]
+
+    def check(self, update_id: Optional[int]) -> bool:
+        if not self.size or update_id is None:
+            return True
+        with self._conn:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO seen_updates (update_id) VALUES (?)", (update_id,))
+            if cursor.rowcount == 0:
+                self.duplicates += 1
+                return False
+            self._inserted += 1
+            if self._inserted % self.prune_every == 0:
+                self._conn.execute("DELETE FROM seen_updates WHERE update_id <= ?", (update_id - self.size,))
+        return True
+
+
+# ====== Защита от флуда ======
+# Один пользователь, часто жмущий «Далее →» или /view, не должен занимать
+# обработчики. Лимит — token bucket на пользователя отдельно для команд,
+# нажатий кнопок и обычного текста; лишнее отбрасывается по сырому JSON,
+# до Update.de_json. Обновления других типов и пользователи из exempt
+# не ограничиваются. Сообщить пользователю об отброшенном обновлении
+# можно не чаще раза за время полного пополнения его лимита (notify),
+# так что флуд не превращается в такой же поток ответов.
+class FloodGuard:
+    def __init__(self, limits: Dict[str, Tuple[float, float]], exempt: Iterable[int] = ()):
+        # limits: вид -> (токенов в секунду, размер пачки); rate 0 — без лимита
+        self.buckets = {kind: KeyedTokenBuckets(rate, burst)
+                        for kind, (rate, burst) in limits.items() if rate > 0}
+        self.notices = {kind: KeyedTokenBuckets(rate / max(burst, 1), 1)
+                        for kind, (rate, burst) in limits.items() if rate > 0}
+        self.exempt = set(exempt)
+        self.throttled = {kind: 0 for kind in limits}
+
+    @staticmethod
+    def classify(json_data: dict) -> Tuple[Optional[str], Optional[int]]:
+        # (вид обновления, id пользователя) по сырому JSON
+        callback = json_data.get('callback_query')
+        if callback:
+            return 'callback', callback.get('from', {}).get('id')
+        message = json_data.get('message')
+        if message and 'text' in message:
+            kind = 'command' if message['text'].startswith('/') else 'text'
+            return kind, message.get('from', {}).get('id')
+        return None, None
+
+    def allow(self, json_data: dict) -> bool:
+        kind, user_id = self.classify(json_data)
+        buckets = self.buckets.get(kind)
+        if buckets is None or user_id is None or user_id in self.exempt:
+            return True
+        if buckets.try_acquire(user_id):
+            return True
+        self.throttled[kind] += 1
+        return False
+
+    def notify(self, json_data: dict) -> bool:
+        # True — об отброшенном обновлении стоит сообщить пользователю
+        kind, user_id = self.classify(json_data)
+        notices = self.notices.get(kind)
+        return notices is not None and user_id is not None and notices.try_acquire(user_id)
@@ -0,0 +1,71 @@
+import json
+import time
+import queue
+import atexit
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Обновление, которое сейчас обрабатывается в этой задаче asyncio;
+# подставляется во все записи лога, сделанные из обработчика
+current_update = contextvars.ContextVar('current_update', default=(None, None))
+
+# Дополнительные поля записи, которые попадают в JSON как есть
+EXTRA_FIELDS = ('update_id', 'handler', 'duration_ms', 'payload')
+
+
+class UpdateContextFilter(logging.Filter):
+    def filter(self, record):
+        update_id, handler = current_update.get()
+        if getattr(record, 'update_id', None) is None:
+            record.update_id = update_id
+        if getattr(record, 'handler', None) is None:
+            record.handler = handler
+        return True
+
+
+# ====== JSON lines ======
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# ====== Настройка ======
+# Потоки, которые пишут в лог (event loop, waitress, WriteBehind), только
+# кладут запись в очередь; в файл и консоль её пишет отдельный поток
+# QueueListener. Файл ротируется по размеру.
+def setup_logging(path: str, level: int = logging.INFO, json_format: bool = True,
+                  max_bytes: int = 10 * 1024 * 1024, backups: int = 5) -> QueueListener:
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,10 +1,13 @@
 import re
-import pickle
 import os
+import json
 import time
 import asyncio
+import random
+import contextlib
+import sys
+import signal
 import logging
-from collections import defaultdict
 from typing import Optional, Union, Any
 from threading import Thread
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -13,72 +16,260 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     ContextTypes,
     filters
 )
 from flask import Flask, request, jsonify
 import telegram
 
+from cache import ChatCache, PageCache
+from expiry import ExpirySweeper
+from export import ExportQuery, export_ankets
+from search import tokenize
+from ingress import FloodGuard, SqliteUpdateDedup, UpdateDedup
+from logsetup import current_update, setup_logging
+from metrics import REGISTRY, InstrumentedRequest, instrument_methods
+from moderation import BannedWords
+from ratelimit import OutboundScheduler, PRIORITY_USER, PRIORITY_CHANNEL, PRIORITY_ADMIN, PRIORITY_BACKGROUND
+from storage import Anket, Storage
+from repository import MemoryRepository, SqliteRepository
+
 # ====== Настройка логгирования ======
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json | text
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', 5))
+# Доля обновлений, тело которых целиком пишется в лог (0 — никогда, 1 — всегда)
+LOG_PAYLOAD_SAMPLE = float(os.getenv('LOG_PAYLOAD_SAMPLE', 0))
+
+# Несколько процессов uvicorn (WEB_WORKERS > 1, только с SQLite). BOT_WORKER
+# выставляет родительский процесс для воркеров
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+IS_WORKER = os.getenv('BOT_WORKER') == '1'
+if IS_WORKER:
+    # У каждого воркера свой файл: ротация одного файла из нескольких
+    # процессов теряет записи
+    LOG_FILE = "{0}.{2}{1}".format(*os.path.splitext(LOG_FILE), os.getpid())
+
+log_listener = setup_logging(
+    LOG_FILE,
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    json_format=LOG_FORMAT == 'json',
+    max_bytes=LOG_MAX_BYTES,
+    backups=LOG_BACKUPS
 )
 logger = logging.getLogger(__name__)
 
 # ====== Константы ======
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory')
 DATA_FILE = "bot_data.pkl"
+JOURNAL_FILE = "bot_data.journal"
+SQLITE_FILE = os.getenv('SQLITE_FILE', "bot_data.db")
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', 1000))
+PERSIST_INTERVAL = float(os.getenv('PERSIST_INTERVAL', 1.0))
+PERSIST_BATCH_SIZE = int(os.getenv('PERSIST_BATCH_SIZE', 500))
 CHANNEL_ID = "@VLV_LP"
 POST_COOLDOWN = 3600
 BANNED_WORDS = ["тупая", "дура", "блять"]
+# Файл со списком слов (по одному на строку) перечитывается на лету;
+# пока его нет, используется BANNED_WORDS
+BANNED_WORDS_FILE = os.getenv('BANNED_WORDS_FILE', "banned_words.txt")
 ADMIN_ID = 1340811422
 YOOMONEY_LINK = "https://yoomoney.ru/to/4100118961510419"
 ANKETS_PER_PAGE = 5
 TOKEN = os.getenv('TELEGRAM_TOKEN', '7820852763:AAEjYuOtZnOoCGtoEkQfwYzsk6PLEg_7frk')
-WEBHOOK_URL = f"https://girlsbot.onrender.com/{TOKEN}"
+# Адрес Bot API можно подменить локальной заглушкой для тестов и нагрузки
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', f"https://girlsbot.onrender.com/{TOKEN}")
+# asgi — uvicorn в одном event loop с ботом, flask — прежний waitress
+SERVER_MODE = os.getenv('SERVER_MODE', 'asgi')
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 8))
+# Сколько раз повторять сетевые фазы запуска (getMe, вебхук) и пауза перед
+# первым повтором, дальше она удваивается. Если запуск всё же сорвался,
+# процесс завершается с кодом 1, чтобы платформа его перезапустила
+STARTUP_RETRIES = int(os.getenv('STARTUP_RETRIES', 5))
+STARTUP_RETRY_DELAY = float(os.getenv('STARTUP_RETRY_DELAY', 2))
+CHAT_CACHE_TTL = float(os.getenv('CHAT_CACHE_TTL', 3600))
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', 10000))
+GET_CHAT_CONCURRENCY = int(os.getenv('GET_CHAT_CONCURRENCY', 10))
+# Сколько секунд живут снимки страниц /view для листания назад/вперёд (0 — не кэшировать)
+PAGE_CACHE_TTL = float(os.getenv('PAGE_CACHE_TTL', 60))
+# Выгрузка каталога: анкет за одно чтение, сколько байт файла держать
+# в памяти, прежде чем он уйдёт во временный файл на диске, и наибольший
+# размер одного файла (отправка читает его в память целиком, лимит Bot API — 50 МБ)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_SPOOL_BYTES = int(os.getenv('EXPORT_SPOOL_BYTES', 1024 * 1024))
+EXPORT_PART_BYTES = int(os.getenv('EXPORT_PART_BYTES', 20 * 1024 * 1024))
+# Срок жизни анкеты в секундах (0 — бессрочно) и сколько истёкших удалять за раз
+ANKET_TTL = float(os.getenv('ANKET_TTL', 0))
+EXPIRY_BATCH_SIZE = int(os.getenv('EXPIRY_BATCH_SIZE', 100))
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHANNEL_PER_MINUTE = float(os.getenv('OUTBOUND_CHANNEL_PER_MINUTE', 20))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+# Сколько последних update_id помнить для отсева повторных доставок (0 — не отсеивать)
+UPDATE_DEDUP_WINDOW = int(os.getenv('UPDATE_DEDUP_WINDOW', 10000))
+# Лимиты входящих обновлений на пользователя: в секунду и размер пачки (0 — без лимита)
+FLOOD_COMMAND_RATE = float(os.getenv('FLOOD_COMMAND_RATE', 1))
+FLOOD_COMMAND_BURST = float(os.getenv('FLOOD_COMMAND_BURST', 5))
+FLOOD_CALLBACK_RATE = float(os.getenv('FLOOD_CALLBACK_RATE', 2))
+FLOOD_CALLBACK_BURST = float(os.getenv('FLOOD_CALLBACK_BURST', 8))
+FLOOD_TEXT_RATE = float(os.getenv('FLOOD_TEXT_RATE', 1))
+FLOOD_TEXT_BURST = float(os.getenv('FLOOD_TEXT_BURST', 5))
+# Сколько ответов на отброшенные нажатия кнопок может ждать Bot API одновременно
+FLOOD_ANSWER_LIMIT = int(os.getenv('FLOOD_ANSWER_LIMIT', 50))
 
 # ====== Инициализация данных ======
 def load_data():
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "rb") as f:
-                return pickle.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки данных: {e}")
-    return {
-        'user_ankets': {},
-        'banned_users': set(),
-        'viewed_ankets': defaultdict(set),
-        'ankets_list': [],
-        'last_post_times': {},
-        'channel_posts': {}
-    }
+    # STORAGE_BACKEND=sqlite — база SQLite в режиме WAL,
+    # иначе всё в памяти со снапшотом и журналом на диске
+    if STORAGE_BACKEND == 'sqlite':
+        logger.info(f"Хранилище: SQLite ({SQLITE_FILE})")
+        return SqliteRepository(SQLITE_FILE)
+    storage = Storage(DATA_FILE, JOURNAL_FILE, compact_every=JOURNAL_COMPACT_EVERY)
+    return MemoryRepository(storage, interval=PERSIST_INTERVAL, batch_size=PERSIST_BATCH_SIZE)
 
 def save_data():
+    # Финальный сброс несохранённых изменений при остановке
+    if repo is None:
+        return
     try:
-        with open(DATA_FILE, "wb") as f:
-            pickle.dump({
-                'user_ankets': user_ankets,
-                'banned_users': banned_users,
-                'viewed_ankets': dict(viewed_ankets),
-                'ankets_list': ankets_list,
-                'last_post_times': last_post_times,
-                'channel_posts': channel_posts
-            }, f)
+        repo.close()
     except Exception as e:
         logger.error(f"Ошибка сохранения данных: {e}")
 
-data = load_data()
-user_ankets = data['user_ankets']
-banned_users = data['banned_users']
-viewed_ankets = data['viewed_ankets']
-ankets_list = data['ankets_list']
-last_post_times = data['last_post_times']
-channel_posts = data['channel_posts']
+# Репозиторий создаётся при запуске в init_repo, не при импорте
+repo = None
+# Удаление анкет по сроку, если задан ANKET_TTL
+expiry = None
+chat_cache = ChatCache(ttl=CHAT_CACHE_TTL, maxsize=CHAT_CACHE_SIZE, concurrency=GET_CHAT_CONCURRENCY)
+page_cache = PageCache(ttl=PAGE_CACHE_TTL)
+banned_words = BannedWords(BANNED_WORDS_FILE, BANNED_WORDS)
+# Лимиты Telegram общие на бота, поэтому воркеры делят их поровну
+WORKER_SHARE = WEB_WORKERS if IS_WORKER else 1
+outbound = OutboundScheduler(global_rate=OUTBOUND_GLOBAL_RATE / WORKER_SHARE, chat_rate=OUTBOUND_CHAT_RATE,
+                             group_per_minute=OUTBOUND_CHANNEL_PER_MINUTE / WORKER_SHARE,
+                             max_retries=OUTBOUND_MAX_RETRIES)
+if IS_WORKER:
+    update_dedup = SqliteUpdateDedup(SQLITE_FILE, UPDATE_DEDUP_WINDOW)
+else:
+    update_dedup = UpdateDedup(UPDATE_DEDUP_WINDOW)
+flood_guard = FloodGuard({
+    'command': (FLOOD_COMMAND_RATE, FLOOD_COMMAND_BURST),
+    'callback': (FLOOD_CALLBACK_RATE, FLOOD_CALLBACK_BURST),
+    'text': (FLOOD_TEXT_RATE, FLOOD_TEXT_BURST)
+}, exempt=[ADMIN_ID])
+
+# ====== Метрики ======
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Время работы обработчиков обновлений", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Обработчики, завершившиеся исключением", ("handler",))
+STORAGE_SECONDS = REGISTRY.histogram(
+    "bot_storage_seconds", "Время операций хранилища", ("op",))
+
+REGISTRY.gauge("bot_update_queue_size", "Обновления, ожидающие обработчиков",
+               lambda: application.update_queue.qsize() if application else None)
+REGISTRY.gauge("bot_outbound_queue_size", "Сообщения в очереди на отправку", outbound.qsize)
+REGISTRY.counter_func("bot_outbound_sent_total", "Отправленные сообщения", lambda: outbound.sent)
+REGISTRY.counter_func("bot_outbound_retries_total", "Повторы отправки", lambda: outbound.retries)
+REGISTRY.counter_func("bot_outbound_failed_total", "Сообщения, которые не удалось отправить", lambda: outbound.failed)
+REGISTRY.gauge("bot_chat_cache_size", "Записей в кэше username'ов", lambda: len(chat_cache))
+REGISTRY.counter_func("bot_chat_cache_hits_total", "Попадания в кэш username'ов", lambda: chat_cache.hits)
+REGISTRY.counter_func("bot_chat_cache_misses_total", "Промахи кэша username'ов", lambda: chat_cache.misses)
+REGISTRY.counter_func("bot_duplicate_updates_total", "Повторные доставки, отброшенные без обработки",
+                      lambda: update_dedup.duplicates)
+REGISTRY.counter_func("bot_throttled_updates_total", "Обновления, отброшенные лимитом на пользователя",
+                      lambda: flood_guard.throttled, label="kind")
+REGISTRY.counter_func("bot_page_cache_hits_total", "Страницы /view из кэша снимков", lambda: page_cache.hits)
+REGISTRY.counter_func("bot_page_cache_misses_total", "Страницы /view, собранные заново", lambda: page_cache.misses)
+REGISTRY.gauge("bot_ankets", "Анкет в каталоге", lambda: repo.count_ankets() if repo else None)
+REGISTRY.counter_func("bot_expired_ankets_total", "Анкеты, удалённые по сроку",
+                      lambda: expiry.expired if expiry is not None else None)
+REGISTRY.gauge("bot_expiry_heap_size", "Анкеты в расписании удаления по сроку",
+               lambda: len(expiry) if expiry is not None else None)
+REGISTRY.gauge("bot_startup_phase_seconds", "Длительность фаз запуска",
+               lambda: startup['phases'], label="phase")
+
+def init_repo():
+    # Загрузка данных (для памяти — снапшот и журнал целиком) и обёртки метрик
+    global repo
+    loaded = load_data()
+    instrument_methods(loaded, STORAGE_SECONDS,
+                       [name for name in vars(type(loaded)) if not name.startswith('_') and name != 'close'])
+    if isinstance(loaded, MemoryRepository):
+        # Запись журнала и сжатие идут в фоновом потоке, мимо методов репозитория
+        instrument_methods(loaded.storage, STORAGE_SECONDS, ('append_many', 'compact'))
+        REGISTRY.gauge("bot_persist_pending", "Изменения, ещё не записанные в журнал",
+                       loaded.persistence.pending)
+    repo = loaded
+
+def init_expiry():
+    global expiry
+    sweeper = ExpirySweeper(repo, ANKET_TTL, expire_ankets, batch_size=EXPIRY_BATCH_SIZE)
+    count = sweeper.load()
+    logger.info(f"Срок жизни анкет {ANKET_TTL:.0f} с, в расписании: {count}")
+    expiry = sweeper
+
+# ====== Холодный старт ======
+# HTTP-сервер отвечает сразу, а данные, getMe и вебхук готовятся в фоне.
+# Обновления, пришедшие за это время, копятся в update_queue и
+# разбираются после application.start(). Длительность каждой фазы —
+# в лог, /health и метрику bot_startup_phase_seconds.
+startup = {"status": "starting", "phases": {}}
+# Код выхода процесса: 1, если запуск сорвался
+exit_code = 0
+startup_task = None
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        startup['phases'][name] = duration
+        logger.info(f"Запуск: {name} за {duration * 1000:.0f} мс",
+                    extra={'duration_ms': round(duration * 1000, 1)})
+
+async def retry_phase(name: str, make_call):
+    # Сетевой сбой при getMe или setWebhook обычно временный
+    for attempt in range(1, STARTUP_RETRIES + 1):
+        try:
+            with startup_phase(name):
+                result = await make_call()
+            startup['status'] = 'starting'
+            return result
+        except telegram.error.NetworkError as e:
+            if attempt >= STARTUP_RETRIES:
+                raise
+            # Пока связи с Bot API нет, новые обновления не принимаем
+            startup['status'] = 'retrying'
+            delay = STARTUP_RETRY_DELAY * 2 ** (attempt - 1)
+            logger.warning(f"Запуск: {name} не удался ({e}), повтор {attempt}/{STARTUP_RETRIES - 1} через {delay:.0f} с")
+            await asyncio.sleep(delay)
+
+def exit_after_failed_startup():
+    # Обновления Telegram держит у себя, пока вебхук отвечает 503, так что
+    # перезапущенный процесс их получит. SIGTERM останавливает сервер штатно
+    # и в режиме uvicorn, и в режиме Flask
+    global exit_code
+    exit_code = 1
+    signal.raise_signal(signal.SIGTERM)
+
+def accepts_updates() -> bool:
+    # Пока идёт запуск, обновления копятся в update_queue и будут разобраны;
+    # при повторах и после сбоя вебхук отвечает 503, и Telegram их придержит
+    return startup['status'] in ('starting', 'ok')
+
+def health_status():
+    # 503 только если запуск сорвался; пока данные грузятся — 200 со status=starting
+    body = {"status": startup['status'],
+            "startup_ms": {name: round(duration * 1000, 1) for name, duration in startup['phases'].items()},
+            "chat_cache": chat_cache.stats(), "throttled": flood_guard.throttled}
+    return (503 if startup['status'] == 'failed' else 200), body
 
 # ====== Инициализация Flask ======
 app = Flask(__name__)
@@ -89,45 +280,106 @@ def home():
 
 @app.route('/health')
 def health():
-    return jsonify({"status": "ok"})
+    code, body = health_status()
+    return jsonify(body), code
+
+@app.route('/metrics')
+def metrics():
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 # ====== Telegram Bot Functions ======
 def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
 
-async def safe_reply(update: Update, text: str, reply_markup=None):
+async def safe_reply(update: Update, text: str, reply_markup=None, priority: int = PRIORITY_USER):
     try:
-        if update.message:
-            await update.message.reply_text(text, reply_markup=reply_markup)
-        elif update.callback_query and update.callback_query.message:
-            await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
+        message = update.message
+        if not message and update.callback_query:
+            message = update.callback_query.message
+        if message:
+            await outbound.send(message.chat_id,
+                                lambda: message.reply_text(text, reply_markup=reply_markup),
+                                priority)
     except Exception as e:
         logger.error(f"Ошибка отправки сообщения: {e}")
 
-async def publish_to_channel(user_id: int, url: str, comment: str, context: ContextTypes.DEFAULT_TYPE):
+async def remember_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Username из входящих обновлений бесплатно пополняет кэш
+    user = update.effective_user
+    if user:
+        chat_cache.remember(user.id, user.username or "")
+
+# Посты в канал уходят с лимитом ~20 в минуту, поэтому обработчик не ждёт
+# их: отвечает пользователю и отпускает слот UPDATE_WORKERS, а публикация
+# или удаление доделываются фоновой задачей. Ссылки на задачи держим до
+# завершения, иначе сборщик мусора может снять их на середине
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background_task)
+    return task
+
+def finish_background_task(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Ошибка фоновой задачи: {task.exception()}")
+
+async def delete_channel_post(bot, message_id: int, priority: int = PRIORITY_CHANNEL) -> bool:
+    try:
+        await outbound.send(CHANNEL_ID, lambda: bot.delete_message(chat_id=CHANNEL_ID, message_id=message_id),
+                            priority)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка удаления из канала: {e}")
+        return False
+
+async def expire_ankets(ankets):
+    # Посты истёкших анкет снимаются с низшим приоритетом; пачка считается
+    # обработанной, когда удаления прошли, поэтому очередь отправки не
+    # разрастается, сколько бы анкет ни истекло разом
+    page_cache.invalidate()
+    await asyncio.gather(*(delete_channel_post(application.bot, anket.channel_message_id, PRIORITY_BACKGROUND)
+                           for anket in ankets if anket.channel_message_id))
+
+async def publish_to_channel(anket: Anket, context: ContextTypes.DEFAULT_TYPE):
     try:
-        user = await context.bot.get_chat(user_id)
-        username = f"@{user.username}" if user.username else f"ID:{user_id}"
+        user_name = await chat_cache.resolve(context.bot, anket.user_id)
+        username = f"@{user_name}" if user_name else f"ID:{anket.user_id}"
         message = (f"📌 Новая анкета от {username}:\n\n"
-                  f"{comment}\n\n"
-                  f"🔗 {url}\n\n"
+                  f"{anket.comment}\n\n"
+                  f"🔗 {anket.url}\n\n"
                   f"#анкета #знакомства")
-        sent_message = await context.bot.send_message(
+        sent_message = await outbound.send(CHANNEL_ID, lambda: context.bot.send_message(
             chat_id=CHANNEL_ID,
             text=message,
             disable_web_page_preview=True
-        )
-        channel_posts[user_id] = sent_message.message_id
-        save_data()
+        ), PRIORITY_CHANNEL)
+        if repo.get_anket(anket.id) is None:
+            # Анкету успели удалить, пока пост ждал очереди в канал
+            await delete_channel_post(context.bot, sent_message.message_id)
+            return True
+        repo.set_channel_post(anket.id, sent_message.message_id)
         return True
     except Exception as e:
         logger.error(f"Ошибка публикации: {str(e)}")
         return False
 
+async def publish_in_background(update: Update, context: ContextTypes.DEFAULT_TYPE, anket: Anket):
+    # Пользователь уже получил ответ; о сбое публикации сообщаем отдельно
+    if await publish_to_channel(anket, context):
+        return
+    await safe_reply(update, "⚠️ Анкета сохранена, но возникла проблема с публикацией. Админ уведомлен.")
+    await outbound.send(ADMIN_ID, lambda: context.bot.send_message(
+        chat_id=ADMIN_ID,
+        text=f"⚠️ Ошибка публикации анкеты от @{update.effective_user.username}"
+    ), PRIORITY_ADMIN)
+
 # ====== Обработчики команд ======
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id in banned_users:
+    if repo.is_banned(user_id):
         await safe_reply(update, "❌ Вы заблокированы")
         return
 
@@ -135,13 +387,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Доступные команды:\n"
             "/add - Добавить анкету\n"
             "/view - Просмотреть анкеты\n"
+            "/search - Найти анкеты по словам\n"
             "/delete - Удалить свою анкету\n"
             "/help - Помощь\n"
             "/help_create - Как создать анкету\n"
             "/donate - Поддержать проект")
 
     if is_admin(user_id):
-        text += "\n\nАдминистратору доступны команды:\n/admin - Панель управления"
+        text += ("\n\nАдминистратору доступны команды:\n/admin - Панель управления\n"
+                 "/reload_words - Перечитать список запрещённых слов")
 
     await safe_reply(update, text)
 
@@ -161,24 +415,30 @@ async def donate(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Спасибо за вашу поддержку!")
     await safe_reply(update, text)
 
+def anket_refusal(user_id: int) -> Optional[str]:
+    # Почему пользователь сейчас не может добавить анкету (None — может)
+    if not repo.has_anket(user_id):
+        return None
+    last_time = repo.last_post_time(user_id)
+    if time.time() - last_time < POST_COOLDOWN:
+        remaining = int((POST_COOLDOWN - (time.time() - last_time)) // 60)
+        return f"❌ Подождите {remaining} минут"
+    return "❌ Сначала удалите текущую анкету (/delete)"
+
 async def add_anket(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id in banned_users:
+    if repo.is_banned(user_id):
         await safe_reply(update, "❌ Вы заблокированы")
         return
 
-    if user_id in user_ankets:
-        last_time = last_post_times.get(user_id, 0)
-        if time.time() - last_time < POST_COOLDOWN:
-            remaining = int((POST_COOLDOWN - (time.time() - last_time)) // 60)
-            await safe_reply(update, f"❌ Подождите {remaining} минут")
-            return
-
-        await safe_reply(update, "❌ Сначала удалите текущую анкету (/delete)")
+    refusal = anket_refusal(user_id)
+    if refusal:
+        await safe_reply(update, refusal)
         return
 
-    context.user_data['awaiting_anket'] = True
-    context.user_data['anket_user_id'] = user_id
+    # Состояние живёт в репозитории, а не в context.user_data: при
+    # нескольких процессах следующее сообщение может попасть в другой
+    repo.set_state(user_id, 'awaiting_anket')
 
     await safe_reply(
         update,
@@ -190,144 +450,218 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text
 
-    if not context.user_data.get('awaiting_anket', False) or context.user_data.get('anket_user_id') != user_id:
-        return
-
-    if any(word in text.lower() for word in BANNED_WORDS):
-        await safe_reply(update, "❌ Ваше сообщение содержит запрещённые слова")
-        context.user_data['awaiting_anket'] = False
+    # Состояние снимается сразу: из двух одновременных сообщений
+    # анкетой станет только одно
+    if not repo.pop_state(user_id, 'awaiting_anket'):
         return
 
     parts = text.split(maxsplit=1)
     if len(parts) < 2:
         await safe_reply(update, "❌ Нужна ссылка И комментарий через пробел")
-        context.user_data['awaiting_anket'] = False
         return
 
     url, comment = parts
 
+    # Проверяется только комментарий: в id формы латиница тоже
+    # складывается в «слова» (1FAIpQLSdXEP... -> хер)
+    if banned_words.find(comment):
+        await safe_reply(update, "❌ Ваше сообщение содержит запрещённые слова")
+        return
+
     if not re.match(r'^https:\/\/(docs\.google\.com|forms\.office\.com|forms\.gle)\/.+', url):
         await safe_reply(update, "❌ Это не ссылка на Google Forms или Microsoft Forms")
-        context.user_data['awaiting_anket'] = False
         return
 
-    user_ankets[user_id] = {'url': url, 'comment': comment, 'time': time.time()}
-    ankets_list.append((user_id, url, comment))
-    last_post_times[user_id] = time.time()
-    save_data()
-
-    if await publish_to_channel(user_id, url, comment, context):
-        await safe_reply(update, "✅ Ваша анкета успешно добавлена и опубликована!")
-    else:
-        await safe_reply(update, "✅ Анкета сохранена, но возникла проблема с публикацией. Админ уведомлен.")
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=f"⚠️ Ошибка публикации анкеты от @{update.effective_user.username}"
-        )
+    # Проверка «одна анкета на пользователя» повторяется атомарно с добавлением
+    anket = repo.try_add_anket(user_id, url, comment)
+    if anket is None:
+        await safe_reply(update, anket_refusal(user_id) or "❌ Сначала удалите текущую анкету (/delete)")
+        return
+    if expiry is not None:
+        expiry.schedule(anket)
 
-    context.user_data['awaiting_anket'] = False
-    if 'anket_user_id' in context.user_data:
-        del context.user_data['anket_user_id']
+    await safe_reply(update, "✅ Ваша анкета успешно добавлена и скоро появится в канале!")
+    run_in_background(publish_in_background(update, context, anket))
 
-async def view_ankets(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
-    user_id = update.effective_user.id
-    if not ankets_list:
-        await safe_reply(update, "😢 Пока нет доступных анкет")
+async def edit_or_reply(update: Update, text: str, reply_markup=None):
+    # Нажатие кнопки редактирует сообщение, на котором она была, команда
+    # отправляет новое — в чате не копятся устаревшие клавиатуры
+    query = update.callback_query
+    if query is None or query.message is None:
+        await safe_reply(update, text, reply_markup)
         return
+    try:
+        await outbound.send(query.message.chat_id,
+                            lambda: query.edit_message_text(text, reply_markup=reply_markup))
+    except telegram.error.BadRequest as e:
+        # Повторное нажатие той же кнопки — сообщение уже такое
+        if "not modified" not in str(e):
+            logger.error(f"Ошибка редактирования сообщения: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка редактирования сообщения: {e}")
 
+def load_page(user_id: int, after_id: int = 0, before_id: Optional[int] = None):
+    # Страница по курсору: анкеты сразу после after_id или сразу перед
+    # before_id, плюс признаки соседних страниц. Берётся на одну анкету
+    # больше, чтобы понять, есть ли страница дальше
     if is_admin(user_id):
-        keyboard = []
-        for idx, (_, url, comment) in enumerate(ankets_list[page * ANKETS_PER_PAGE:(page + 1) * ANKETS_PER_PAGE], 1):
-            btn_text = f"Анкета {idx}: {comment[:30]}..."
-            keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"view_{idx-1}")])
-
-        if len(ankets_list) > (page + 1) * ANKETS_PER_PAGE:
-            keyboard.append([InlineKeyboardButton("Далее →", callback_data=f"page_{page+1}")])
-
-        await safe_reply(update, "📋 Все анкеты (админ-режим):", reply_markup=InlineKeyboardMarkup(keyboard))
+        def fetch(limit, **cursor):
+            return repo.list_ankets(0, limit, **cursor)
+    else:
+        def fetch(limit, **cursor):
+            return repo.unseen_ankets(user_id, 0, limit, **cursor)
+
+    if before_id is None:
+        ankets = fetch(ANKETS_PER_PAGE + 1, after_id=after_id)
+        has_next = len(ankets) > ANKETS_PER_PAGE
+        ankets = ankets[:ANKETS_PER_PAGE]
+        has_prev = bool(ankets) and after_id > 0 and bool(fetch(1, before_id=ankets[0].id))
+    else:
+        ankets = fetch(ANKETS_PER_PAGE + 1, before_id=before_id)
+        has_prev = len(ankets) > ANKETS_PER_PAGE
+        ankets = ankets[-ANKETS_PER_PAGE:]
+        has_next = bool(ankets) and bool(fetch(1, after_id=ankets[-1].id))
+    return ankets, has_prev, has_next
+
+def anket_buttons(ankets):
+    return [[InlineKeyboardButton(f"Анкета {anket.id}: {anket.comment[:30]}...", callback_data=f"view_{anket.id}")]
+            for anket in ankets]
+
+async def view_ankets(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                      after_id: int = 0, before_id: Optional[int] = None):
+    # Курсор — id крайней анкеты на текущей странице: «Далее →» несёт
+    # page_<последний id>, «← Назад» — prev_<первый id>
+    user_id = update.effective_user.id
+    key = f"page_{after_id}" if before_id is None else f"prev_{before_id}"
+    page = page_cache.get(user_id, key) if update.callback_query else None
+    if page is None:
+        page = load_page(user_id, after_id, before_id)
+        if not page[0] and (after_id or before_id is not None):
+            # С курсора ничего не осталось (анкеты удалены или просмотрены) — с начала
+            page = load_page(user_id)
+        page_cache.put(user_id, key, page)
+    ankets, has_prev, has_next = page
+
+    if not ankets:
+        if not repo.count_ankets():
+            await edit_or_reply(update, "😢 Пока нет доступных анкет")
+        else:
+            await edit_or_reply(update, "✨ Вы просмотрели все доступные анкеты!")
         return
 
-    unseen = [i for i, (uid, _, _) in enumerate(ankets_list) if uid != user_id and i not in viewed_ankets[user_id]]
-    if not unseen:
-        await safe_reply(update, "✨ Вы просмотрели все доступные анкеты!")
+    keyboard = anket_buttons(ankets)
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("← Назад", callback_data=f"prev_{ankets[0].id}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Далее →", callback_data=f"page_{ankets[-1].id}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    title = "📋 Все анкеты (админ-режим):" if is_admin(user_id) else "📋 Выберите анкету для просмотра:"
+    await edit_or_reply(update, title, InlineKeyboardMarkup(keyboard))
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    words = tokenize(' '.join(context.args or ()))
+    if not words:
+        await safe_reply(update, "🔎 Напишите слова после команды, например: /search опрос студ\n"
+                                 "Ищутся анкеты, где есть все слова (можно начало слова)")
         return
+    await search_results(update, context, words)
 
-    keyboard = []
-    for idx in unseen[page * ANKETS_PER_PAGE:(page + 1) * ANKETS_PER_PAGE]:
-        _, url, comment = ankets_list[idx]
-        btn_text = f"Анкета {idx+1}: {comment[:30]}..."
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"view_{idx}")])
-
-    if len(unseen) > (page + 1) * ANKETS_PER_PAGE:
-        keyboard.append([InlineKeyboardButton("Далее →", callback_data=f"page_{page+1}")])
+async def search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, words, after_id: int = 0):
+    # Запрос едет в callback_data кнопки «Далее →» вместе с курсором,
+    # поэтому следующую страницу может показать любой процесс
+    user_id = update.effective_user.id
+    ankets = repo.search_ankets(words, ANKETS_PER_PAGE + 1, after_id,
+                                user_id=None if is_admin(user_id) else user_id)
+    has_next = len(ankets) > ANKETS_PER_PAGE
+    ankets = ankets[:ANKETS_PER_PAGE]
+    query = ' '.join(words)
+    if not ankets:
+        await edit_or_reply(update, f"🔎 По запросу «{query}» {'больше ' if after_id else ''}ничего не найдено")
+        return
 
-    await safe_reply(update, "📋 Выберите анкету для просмотра:", reply_markup=InlineKeyboardMarkup(keyboard))
+    keyboard = anket_buttons(ankets)
+    title = f"🔎 Результаты по запросу «{query}»:"
+    if has_next:
+        data = f"search_{ankets[-1].id}_{query}"
+        if len(data.encode()) <= 64:
+            keyboard.append([InlineKeyboardButton("Далее →", callback_data=data)])
+        else:
+            title += "\nПоказаны первые результаты, уточните запрос короче"
+    await edit_or_reply(update, title, InlineKeyboardMarkup(keyboard))
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     if query.data.startswith("view_"):
-        idx = int(query.data[5:])
-        if 0 <= idx < len(ankets_list):
-            _, url, comment = ankets_list[idx]
+        anket = repo.get_anket(int(query.data[5:]))
+        if anket:
             if not is_admin(query.from_user.id):
-                viewed_ankets[query.from_user.id].add(idx)
-                save_data()
-            await query.edit_message_text(
-                f"🔗 Ссылка: {url}\n📝 Комментарий: {comment}\n\n"
-                "Чтобы вернуться, используйте /view")
+                repo.mark_viewed(query.from_user.id, anket.id)
+                page_cache.invalidate(query.from_user.id)
+            await outbound.send(update.effective_chat.id, lambda: query.edit_message_text(
+                f"🔗 Ссылка: {anket.url}\n📝 Комментарий: {anket.comment}\n\n"
+                "Чтобы вернуться, используйте /view"))
 
-    elif query.data.startswith("page_"):
+    elif query.data.startswith(("page_", "prev_")):
         try:
-            page = int(query.data[5:])
-            await view_ankets(update, context, page)
-        except (ValueError, IndexError) as e:
+            cursor = int(query.data[5:])
+        except ValueError as e:
             logger.error(f"Error processing page data: {e}")
             await safe_reply(update, "❌ Ошибка при обработке страницы")
+            return
+        if query.data.startswith("page_"):
+            await view_ankets(update, context, after_id=cursor)
+        else:
+            await view_ankets(update, context, before_id=cursor)
+
+    elif query.data.startswith("search_"):
+        cursor, _, words = query.data[7:].partition('_')
+        try:
+            after_id = int(cursor)
+        except ValueError as e:
+            logger.error(f"Error processing search data: {e}")
+            await safe_reply(update, "❌ Ошибка при обработке страницы")
+            return
+        await search_results(update, context, words.split(), after_id)
 
     elif query.data.startswith("admin_"):
         if not is_admin(query.from_user.id):
             return
             
         if query.data == "admin_view_all":
-            await admin_view_all_ankets(update, context)
+            await admin_export(update, context)
         elif query.data == "admin_ban":
-            await query.message.reply_text("Введите ID пользователя для блокировки:")
-            context.user_data['awaiting_ban'] = True
+            await safe_reply(update, "Введите ID пользователя для блокировки:")
+            repo.set_state(query.from_user.id, 'awaiting_ban')
         elif query.data == "admin_delete":
-            await query.message.reply_text("Введите номер анкеты для удаления:")
-            context.user_data['awaiting_delete'] = True
+            await safe_reply(update, "Введите номер анкеты для удаления:")
+            repo.set_state(query.from_user.id, 'awaiting_delete')
         elif query.data == "admin_unban":
-            await query.message.reply_text("Введите ID пользователя для разблокировки:")
-            context.user_data['awaiting_unban'] = True
+            await safe_reply(update, "Введите ID пользователя для разблокировки:")
+            repo.set_state(query.from_user.id, 'awaiting_unban')
 
 async def delete_anket(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id not in user_ankets:
+    anket = repo.delete_user_anket(user_id)
+    if not anket:
         await safe_reply(update, "❌ У вас нет анкеты для удаления")
         return
-
-    if user_id in channel_posts:
-        try:
-            await context.bot.delete_message(chat_id=CHANNEL_ID, message_id=channel_posts[user_id])
-            del channel_posts[user_id]
-        except Exception as e:
-            logger.error(f"Ошибка удаления из канала: {e}")
-
-    del user_ankets[user_id]
-    ankets_list[:] = [a for a in ankets_list if a[0] != user_id]
-    if user_id in last_post_times:
-        del last_post_times[user_id]
-    save_data()
+    page_cache.invalidate()
 
     await safe_reply(update, "✅ Ваша анкета успешно удалена")
+    if anket.channel_message_id:
+        run_in_background(delete_channel_post(context.bot, anket.channel_message_id))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = ("📚 Справка по командам:\n\n"
                 "/start - Начало работы с ботом\n"
                 "/add - Добавить новую анкету\n"
                 "/view - Просмотреть доступные анкеты\n"
+                "/search - Найти анкеты по словам\n"
                 "/delete - Удалить свою анкету\n"
                 "/help_create - Как создать анкету\n"
                 "/donate - Поддержать проект\n"
@@ -341,137 +675,375 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     keyboard = [
-        [InlineKeyboardButton("Список всех анкет", callback_data="admin_view_all")],
+        [InlineKeyboardButton("Выгрузить все анкеты", callback_data="admin_view_all")],
         [InlineKeyboardButton("Заблокировать пользователя", callback_data="admin_ban")],
         [InlineKeyboardButton("Разблокировать пользователя", callback_data="admin_unban")],
         [InlineKeyboardButton("Удалить анкету", callback_data="admin_delete")]
     ]
-    await update.message.reply_text("Админ-панель:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await safe_reply(update, "Админ-панель:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def admin_view_all_ankets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def reload_banned_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
+    count = banned_words.reload()
+    await safe_reply(update, f"Список запрещённых слов обновлён: {count}")
 
-    text = "Все анкеты:\n\n"
-    for idx, (user_id, url, comment) in enumerate(ankets_list, 1):
-        try:
-            user = await context.bot.get_chat(user_id)
-            username = f"@{user.username}" if user.username else "нет username"
-            text += f"{idx}. {username} (ID: {user_id}): {comment}\nСсылка: {url}\n\n"
-        except Exception:
-            text += f"{idx}. [недоступный пользователь] (ID: {user_id}): {comment}\nСсылка: {url}\n\n"
+async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Весь каталог одним файлом вместо нарезки текста по 4000 символов
+    if not is_admin(update.effective_user.id):
+        return
+
+    try:
+        query = ExportQuery.parse(context.args or ())
+    except ValueError as e:
+        await safe_reply(update, f"❌ {e}\nФормат: /export [csv|jsonl] [from=ГГГГ-ММ-ДД] "
+                                 "[to=ГГГГ-ММ-ДД] [user=ID] [resolve]", priority=PRIORITY_ADMIN)
+        return
 
-    for i in range(0, len(text), 4000):
-        await update.message.reply_text(text[i:i + 4000])
+    async def usernames(user_ids):
+        if query.resolve:
+            return await chat_cache.resolve_many(context.bot, user_ids)
+        return chat_cache.cached_many(user_ids)
+
+    async def send_part(document, count: int, part: Optional[int]) -> bool:
+        async def upload():
+            # PTB всё равно читает файл в память целиком, а у файла, ещё не
+            # ушедшего на диск, нет имени, на котором InputFile спотыкается,
+            # поэтому передаём байты. При повторе они читаются заново
+            document.seek(0)
+            caption = f"Анкет: {count}" if part is None else f"Анкет: {count}, часть {part}"
+            return await context.bot.send_document(
+                chat_id=update.effective_chat.id, document=document.read(), filename=query.filename(part),
+                caption=caption)
+
+        try:
+            await outbound.send(update.effective_chat.id, upload, PRIORITY_ADMIN)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка отправки выгрузки: {e}")
+            await safe_reply(update, "❌ Не удалось отправить файл выгрузки", priority=PRIORITY_ADMIN)
+            return False
+        finally:
+            document.close()
+
+    # Часть отправляется, когда готова следующая: так единственный файл
+    # уходит без номера части в имени
+    started = time.perf_counter()
+    total = parts = 0
+    ready = None
+    parts_iter = export_ankets(repo, query, usernames, batch_size=EXPORT_BATCH_SIZE,
+                               spool_bytes=EXPORT_SPOOL_BYTES, max_bytes=EXPORT_PART_BYTES)
+    async for document, count in parts_iter:
+        parts += 1
+        total += count
+        if ready and not await send_part(*ready, parts - 1):
+            document.close()
+            await parts_iter.aclose()
+            return
+        ready = (document, count)
+    logger.info(f"Выгрузка {query.fmt}: {total} анкет в {parts} файл(ах) за {time.perf_counter() - started:.2f} с")
+    if not ready:
+        await safe_reply(update, "Анкет по заданным условиям нет", priority=PRIORITY_ADMIN)
+        return
+    await send_part(*ready, parts if parts > 1 else None)
 
 async def handle_admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
+    admin_id = update.effective_user.id
+    if not is_admin(admin_id):
         return
 
-    if context.user_data.get('awaiting_ban', False):
+    state = repo.get_state(admin_id)
+    if state == 'awaiting_ban':
         try:
             user_id = int(update.message.text)
-            banned_users.add(user_id)
-            save_data()
-            await update.message.reply_text(f"Пользователь {user_id} заблокирован")
-            context.user_data['awaiting_ban'] = False
+            repo.ban(user_id)
+            await safe_reply(update, f"Пользователь {user_id} заблокирован")
+            repo.pop_state(admin_id, 'awaiting_ban')
         except Exception:
-            await update.message.reply_text("Неверный ID пользователя")
+            await safe_reply(update, "Неверный ID пользователя")
 
-    elif context.user_data.get('awaiting_unban', False):
+    elif state == 'awaiting_unban':
         try:
             user_id = int(update.message.text)
-            if user_id in banned_users:
-                banned_users.remove(user_id)
-                save_data()
-                await update.message.reply_text(f"Пользователь {user_id} разблокирован")
+            if repo.unban(user_id):
+                await safe_reply(update, f"Пользователь {user_id} разблокирован")
             else:
-                await update.message.reply_text("Этот пользователь не заблокирован")
-            context.user_data['awaiting_unban'] = False
+                await safe_reply(update, "Этот пользователь не заблокирован")
+            repo.pop_state(admin_id, 'awaiting_unban')
         except Exception:
-            await update.message.reply_text("Неверный ID пользователя")
+            await safe_reply(update, "Неверный ID пользователя")
 
-    elif context.user_data.get('awaiting_delete', False):
+    elif state == 'awaiting_delete':
         try:
-            idx = int(update.message.text) - 1
-            if 0 <= idx < len(ankets_list):
-                user_id, url, comment = ankets_list.pop(idx)
-                if user_id in user_ankets:
-                    del user_ankets[user_id]
-                if user_id in last_post_times:
-                    del last_post_times[user_id]
-                save_data()
-
-                if user_id in channel_posts:
-                    try:
-                        await context.bot.delete_message(chat_id=CHANNEL_ID, message_id=channel_posts[user_id])
-                        del channel_posts[user_id]
-                    except Exception:
-                        pass
-
-                await update.message.reply_text("Анкета удалена")
+            anket = repo.delete_anket(int(update.message.text))
+            if anket:
+                page_cache.invalidate()
+                await safe_reply(update, "Анкета удалена")
+                if anket.channel_message_id:
+                    run_in_background(delete_channel_post(context.bot, anket.channel_message_id))
             else:
-                await update.message.reply_text("Неверный номер анкеты")
-            context.user_data['awaiting_delete'] = False
+                await safe_reply(update, "Неверный номер анкеты")
+            repo.pop_state(admin_id, 'awaiting_delete')
         except ValueError:
-            await update.message.reply_text("Неверный номер анкеты")
+            await safe_reply(update, "Неверный номер анкеты")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     error = context.error
     logger.error(f'⚠️ Ошибка: {error}')
     if update and update.effective_user:
         try:
-            await context.bot.send_message(
+            await outbound.send(ADMIN_ID, lambda: context.bot.send_message(
                 chat_id=ADMIN_ID,
                 text=f"Ошибка в боте:\n{error}\nUser: {update.effective_user.id}"
-            )
+            ), PRIORITY_ADMIN)
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения об ошибке: {e}")
 
+async def view_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await view_ankets(update, context)
+
 # ====== Инициализация бота ======
+def timed(callback):
+    # Оборачивает обработчик: все записи лога внутри него получают update_id
+    # и имя обработчика, по завершении пишется время выполнения в лог
+    # и в гистограмму bot_handler_seconds
+    name = callback.__name__
+
+    async def wrapper(update, context):
+        update_id = getattr(update, 'update_id', None)
+        token = current_update.set((update_id, name))
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            HANDLER_SECONDS.observe(duration, name)
+            logger.info("Обработчик выполнен", extra={'duration_ms': round(duration * 1000, 2)})
+            current_update.reset(token)
+
+    wrapper.__name__ = name
+    return wrapper
+
 def create_application():
-    app = Application.builder().token(TOKEN).build()
+    builder = (Application.builder().token(TOKEN).concurrent_updates(UPDATE_WORKERS)
+               .request(InstrumentedRequest(connection_pool_size=256)))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+    app = builder.build()
     
+    app.add_handler(TypeHandler(Update, remember_user), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("add", add_anket))
-    app.add_handler(CommandHandler("view", lambda u, c: view_ankets(u, c, 0)))
+    app.add_handler(CommandHandler("view", view_command))
+    app.add_handler(CommandHandler("search", search_command))
     app.add_handler(CommandHandler("delete", delete_anket))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("help_create", help_create))
     app.add_handler(CommandHandler("donate", donate))
     app.add_handler(CommandHandler("admin", admin_panel))
+    app.add_handler(CommandHandler("reload_words", reload_banned_words))
+    app.add_handler(CommandHandler("export", admin_export))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.User(ADMIN_ID), handle_message))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.User(ADMIN_ID), handle_admin_commands))
     app.add_error_handler(error_handler)
+
+    # remember_user (группа -1) срабатывает на каждое обновление и
+    # не стоит отдельной строки в логе
+    for group, handlers in app.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = timed(handler.callback)
     
     return app
 
 # ====== Обработчик вебхука ======
 application = None
+event_loop = None
+
+async def register_webhook(bot):
+    # Вебхук переустанавливается, только если Telegram знает другой адрес или
+    # другой набор обновлений. Очередь обновлений при этом не сбрасывается:
+    # то, что пришло, пока бот перезапускался, будет обработано
+    info = await bot.get_webhook_info()
+    if info.url == WEBHOOK_URL and sorted(info.allowed_updates or ()) == sorted(Update.ALL_TYPES):
+        logger.info(f"🟢 Вебхук уже установлен: {WEBHOOK_URL}, ожидает обновлений: {info.pending_update_count}")
+        return
+    await bot.set_webhook(url=WEBHOOK_URL, allowed_updates=Update.ALL_TYPES)
+    logger.info(f"🟢 Вебхук установлен: {WEBHOOK_URL}")
+
+async def register_webhook_once():
+    # Для нескольких воркеров вебхук ставит родительский процесс один раз
+    async with create_application().bot as bot:
+        await register_webhook(bot)
+
+async def warm_up():
+    started = time.perf_counter()
+    try:
+        with startup_phase("storage"):
+            await asyncio.to_thread(init_repo)
+        if ANKET_TTL > 0:
+            with startup_phase("expiry"):
+                await asyncio.to_thread(init_expiry)
+        await retry_phase("bot", application.initialize)
+        if not IS_WORKER:
+            await retry_phase("webhook", lambda: register_webhook(application.bot))
+        with startup_phase("handlers"):
+            # start() запускает разбор update_queue с UPDATE_WORKERS параллельными обработчиками
+            await application.start()
+            outbound.start()
+            if expiry is not None:
+                expiry.start()
+    except Exception as e:
+        startup['status'] = 'failed'
+        logger.error(f"Ошибка запуска бота: {e}")
+        exit_after_failed_startup()
+        return
+    startup['status'] = 'ok'
+    logger.info(f"🟢 Бот готов за {(time.perf_counter() - started) * 1000:.0f} мс, "
+                f"обновлений в очереди: {application.update_queue.qsize()}")
+
+async def start_application():
+    global application, startup_task
+    with startup_phase("application"):
+        application = create_application()
+    startup_task = asyncio.get_running_loop().create_task(warm_up())
+
+async def stop_application():
+    if application is None:
+        return
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+        try:
+            await startup_task
+        except asyncio.CancelledError:
+            pass
+    if expiry is not None:
+        await expiry.stop()
+    if background_tasks:
+        # Публикации и удаления в канале, начатые до остановки
+        await asyncio.wait(set(background_tasks), timeout=10)
+    await outbound.stop()
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+
+# Ответы на отброшенные нажатия идут мимо OutboundScheduler: в очереди за
+# лимитом чата флудящего они не успели бы в ~15 с, отведённые на ответ.
+# Их число ограничено: не чаще раза на пользователя за время пополнения
+# лимита (FloodGuard.notify) и не больше FLOOD_ANSWER_LIMIT одновременно
+flood_answers = set()
+
+async def answer_throttled_callback(callback_id: str):
+    try:
+        await application.bot.answer_callback_query(callback_id, text="⏳ Слишком часто, подождите немного")
+    except Exception as e:
+        logger.debug(f"Не удалось ответить на отброшенное нажатие: {e}")
+
+async def enqueue_update(json_data: dict):
+    # Обновление только ставится в очередь, ответ Telegram уходит сразу,
+    # не дожидаясь обработчиков. Повторная доставка и флуд отбрасываются до разбора
+    if not update_dedup.check(json_data.get('update_id')):
+        logger.info("Повторная доставка обновления пропущена", extra={'update_id': json_data.get('update_id')})
+        return
+    if not flood_guard.allow(json_data):
+        logger.debug("Обновление отброшено лимитом", extra={'update_id': json_data.get('update_id')})
+        callback = json_data.get('callback_query')
+        if (callback and callback.get('id') and len(flood_answers) < FLOOD_ANSWER_LIMIT
+                and flood_guard.notify(json_data)):
+            # Без ответа у пользователя крутятся часики на кнопке
+            task = run_in_background(answer_throttled_callback(callback['id']))
+            flood_answers.add(task)
+            task.add_done_callback(flood_answers.discard)
+        return
+    if LOG_PAYLOAD_SAMPLE and random.random() < LOG_PAYLOAD_SAMPLE:
+        logger.info("Получено обновление", extra={'update_id': json_data.get('update_id'), 'payload': json_data})
+    else:
+        logger.debug("Получено обновление", extra={'update_id': json_data.get('update_id')})
+    update = Update.de_json(json_data, application.bot)
+    await application.update_queue.put(update)
 
 @app.route(f'/{TOKEN}', methods=['POST'])
-async def webhook():
-    global application
-    if request.method == "POST":
+def webhook():
+    if application is None or event_loop is None:
+        return jsonify({"status": "starting"}), 503
+    if not accepts_updates():
+        return jsonify({"status": startup['status']}), 503
+    try:
+        json_data = request.get_json()
+        future = asyncio.run_coroutine_threadsafe(enqueue_update(json_data), event_loop)
+        future.result(timeout=10)
+        return jsonify({"status": "ok"}), 200
+    except Exception as e:
+        logger.error(f"Ошибка обработки вебхука: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# ====== ASGI-сервер ======
+async def send_response(send, status: int, body: Union[str, dict], content_type: bytes = b"application/json"):
+    if isinstance(body, dict):
+        body = json.dumps(body, ensure_ascii=False)
+    else:
+        content_type = b"text/plain; charset=utf-8"
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type)]})
+    await send({'type': 'http.response.body', 'body': body.encode()})
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get('body', b"")
+        if not message.get('more_body'):
+            return body
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Данные и бот готовятся в фоне, сервер начинает отвечать сразу
+            await start_application()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await stop_application()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def asgi_app(scope, receive, send):
+    # Приложение работает в том же event loop, что и Application,
+    # поэтому обновления попадают в update_queue без переключения потоков
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    if path == '/':
+        await send_response(send, 200, "Bot is alive!")
+    elif path == '/health':
+        code, body = health_status()
+        await send_response(send, code, body)
+    elif path == '/metrics':
+        await send_response(send, 200, REGISTRY.render())
+    elif path == f'/{TOKEN}':
+        if method != 'POST':
+            await send_response(send, 405, {"status": "method not allowed"})
+            return
+        if not accepts_updates():
+            await send_response(send, 503, {"status": startup['status']})
+            return
         try:
-            json_data = request.get_json()
-            logger.info(f"Получено обновление: {json_data}")
-            
-            if application is None:
-                application = create_application()
-                await application.initialize()
-                await application.start()
-            
-            update = Update.de_json(json_data, application.bot)
-            await application.process_update(update)
-            
-            return jsonify({"status": "ok"}), 200
+            await enqueue_update(json.loads(await read_body(receive)))
+            await send_response(send, 200, {"status": "ok"})
         except Exception as e:
             logger.error(f"Ошибка обработки вебхука: {e}")
-            return jsonify({"status": "error", "message": str(e)}), 500
-    
-    return jsonify({"status": "method not allowed"}), 405
+            await send_response(send, 500, {"status": "error", "message": str(e)})
+    else:
+        await send_response(send, 404, {"status": "not found"})
 
 # ====== Запуск сервера ======
 def run_flask():
@@ -480,41 +1052,58 @@ def run_flask():
     from waitress import serve
     serve(app, host="0.0.0.0", port=port)
 
+def run_flask_mode():
+    # Flask обслуживает HTTP в своих потоках, а бот живёт в одном
+    # постоянном event loop основного потока
+    global event_loop
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    event_loop.run_until_complete(start_application())
+
+    flask_thread = Thread(target=run_flask, daemon=True)
+    flask_thread.start()
+    # Сигнал останавливает loop между задачами; KeyboardInterrupt посреди
+    # задачи PTB мог оставить Application.stop() ждать вечно
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        event_loop.add_signal_handler(sig, event_loop.stop)
+    try:
+        event_loop.run_forever()
+    finally:
+        event_loop.run_until_complete(stop_application())
+
+def run_asgi_mode():
+    import uvicorn
+    port = int(os.environ.get('PORT', 10000))
+    workers = WEB_WORKERS
+    if workers > 1 and STORAGE_BACKEND != 'sqlite':
+        logger.error("WEB_WORKERS > 1 требует STORAGE_BACKEND=sqlite, запускается один процесс")
+        workers = 1
+    if workers > 1:
+        # Воркеры импортируют main заново и только обрабатывают обновления:
+        # состояние общее через SQLite, вебхук ставится здесь
+        logger.info(f"🟢 ASGI-сервер запускается на порту {port}, воркеров: {workers}")
+        asyncio.run(register_webhook_once())
+        os.environ['BOT_WORKER'] = '1'
+        uvicorn.run("main:asgi_app", host="0.0.0.0", port=port, workers=workers,
+                    lifespan="on", log_config=None, access_log=False)
+        return
+    logger.info(f"🟢 ASGI-сервер запускается на порту {port}")
+    uvicorn.run(asgi_app, host="0.0.0.0", port=port, lifespan="on",
+                log_config=None, access_log=False)
+
 # ====== Основная функция ======
 def main():
-    global application
-    
     try:
-        application = create_application()
-        
-        # Создаем новый event loop для основного потока
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Инициализация и установка вебхука
-        loop.run_until_complete(application.initialize())
-        loop.run_until_complete(application.bot.set_webhook(
-            url=WEBHOOK_URL,
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        ))
-        logger.info(f"🟢 Вебхук установлен: {WEBHOOK_URL}")
-        
-        # Запуск Flask в отдельном потоке
-        flask_thread = Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        
-        # Бесконечный цикл
-        while True:
-            time.sleep(10)
-            
+        if SERVER_MODE == 'flask':
+            run_flask_mode()
+        else:
+            run_asgi_mode()
     except Exception as e:
         logger.error(f"Ошибка запуска: {e}")
     finally:
-        if application:
-            loop.run_until_complete(application.shutdown())
         save_data()
         logger.info("🛑 Приложение завершило работу")
+    sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
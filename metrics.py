@@ -0,0 +1,209 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+from typing import Callable, Iterable, Optional, Sequence, Tuple
+
+from telegram.request import HTTPXRequest
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ====== Метрики ======
+# Значения хранятся в словаре по кортежу значений меток; обновление — одно
+# обращение к словарю под коротким локом (в метрики пишет и поток
+# фоновой записи), текст для Prometheus собирается только при запросе.
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _labels(self.labels, labels), value
+
+
+# Значение считывается функцией в момент запроса /metrics (размер очереди и т.п.).
+# С меткой функция возвращает словарь {значение метки: значение}.
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], Optional[float]], label: str = None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception:
+            value = None
+        if value is None:
+            return
+        if self.label is None:
+            yield self.name, "", value
+            return
+        for label, item in value.items():
+            yield self.name, _labels((self.label,), (label,)), item
+
+
+# То же, но для счётчиков, которые уже ведёт сам объект (ChatCache, OutboundScheduler)
+class CounterFunc(Gauge):
+    kind = "counter"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        # Декоратор: время выполнения функции (обычной или async)
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - started, *labels)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return wrapper
+        return decorator
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        bounds = self.buckets + (float('inf'),)
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield self.name + "_bucket", _labels(self.labels, labels, f'le="{_number(bound)}"'), cumulative
+            yield self.name + "_sum", _labels(self.labels, labels), total
+            yield self.name + "_count", _labels(self.labels, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, read: Callable[[], Optional[float]], label: str = None) -> Gauge:
+        return self.register(Gauge(name, help, read, label))
+
+    def counter_func(self, name: str, help: str, read: Callable[[], Optional[float]],
+                     label: str = None) -> CounterFunc:
+        return self.register(CounterFunc(name, help, read, label))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        # Текстовый формат Prometheus 0.0.4
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ====== Обращения к Bot API ======
+API_SECONDS = REGISTRY.histogram(
+    "bot_api_request_seconds", "Время запросов к Bot API", ("method",))
+API_ERRORS = REGISTRY.counter(
+    "bot_api_errors_total", "Запросы к Bot API, завершившиеся ошибкой", ("method",))
+
+
+# HTTP-клиент PTB, который замеряет каждый запрос к Bot API по имени метода
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            API_ERRORS.inc(api_method)
+        return code, payload
+
+
+# ====== Хранилище ======
+# Публичные методы репозитория подменяются на экземпляре обёртками с
+# замером времени, поэтому одинаково работает и для памяти, и для SQLite
+def instrument_methods(obj, histogram: Histogram, names: Iterable[str]):
+    for name in names:
+        setattr(obj, name, histogram.time(name)(getattr(obj, name)))
+    return obj
@@ -0,0 +1,153 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Латиница и цифры, которыми обычно подменяют похожие русские буквы
+LOOKALIKES = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у', 'u': 'и', 'ё': 'е',
+    '0': 'о', '3': 'з', '4': 'ч', '6': 'б', '@': 'а',
+})
+
+
+def normalize(text: str) -> str:
+    # Приводим к нижнему регистру, заменяем похожие символы, выкидываем
+    # разделители внутри слов (д.у-р_а), склеиваем слова из одиночных
+    # букв (д у р а) и схлопываем повторы (дуууура). Пробел между обычными
+    # словами остаётся, чтобы слово не находилось на стыке двух соседних.
+    words = []
+    letters = []
+    for chunk in text.lower().translate(LOOKALIKES).split():
+        word = []
+        for ch in chunk:
+            if ch.isalpha() and (not word or word[-1] != ch):
+                word.append(ch)
+        if not word:
+            continue
+        if len(word) == 1:
+            if not letters or letters[-1] != word[0]:
+                letters.append(word[0])
+            continue
+        if letters:
+            words.append(''.join(letters))
+            letters = []
+        words.append(''.join(word))
+    if letters:
+        words.append(''.join(letters))
+    return ' '.join(words)
+
+
+# ====== Ахо-Корасик ======
+# Автомат строится один раз по всему списку слов, после чего проверка
+# текста — один проход по его символам, сколько бы слов ни было в списке.
+# Запрещённое слово засчитывается только с начала слова текста (дура в
+# «дурак», но не в «процедура»), иначе короткие слова находятся внутри
+# обычных.
+class BannedWordMatcher:
+    def __init__(self, words: Iterable[str]):
+        self.words = sorted({normalize(word) for word in words} - {''})
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._word = [None]
+        for word in self.words:
+            self._add(word)
+        self._build()
+
+    def __len__(self):
+        return len(self.words)
+
+    def _add(self, word: str):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._word.append(None)
+            state = nxt
+        self._output[state] = word
+        self._word[state] = word
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                if self._output[nxt] is None:
+                    self._output[nxt] = self._output[self._fail[nxt]]
+
+    def find(self, text: str) -> Optional[str]:
+        # Первое запрещённое слово в тексте (в нормализованном виде) или None
+        goto, fail, output, words = self._goto, self._fail, self._output, self._word
+        normalized = normalize(text)
+        state = 0
+        for pos, ch in enumerate(normalized):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state] is None:
+                continue
+            # Среди слов, заканчивающихся здесь, ищем начавшееся с начала слова
+            match = state
+            while match:
+                word = words[match]
+                if word is not None:
+                    start = pos - len(word) + 1
+                    if start == 0 or normalized[start - 1] == ' ':
+                        return word
+                match = fail[match]
+        return None
+
+
+# ====== Список слов с перезагрузкой ======
+# Слова читаются из файла (по одному на строку, # — комментарий). Раз в
+# check_interval секунд сверяется mtime файла, и при изменении автомат
+# пересобирается без перезапуска бота. Если файла нет — берутся defaults.
+class BannedWords:
+    def __init__(self, path: str, defaults: Iterable[str] = (), check_interval: float = 5):
+        self.path = path
+        self.defaults = list(defaults)
+        self.check_interval = check_interval
+        self._mtime = None
+        self._next_check = 0.0
+        self.matcher = BannedWordMatcher(self.defaults)
+        self.reload()
+
+    def _read(self) -> List[str]:
+        with open(self.path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+    def reload(self) -> int:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != self._mtime:
+            try:
+                self.matcher = BannedWordMatcher(self._read())
+                logger.info(f"Загружено запрещённых слов: {len(self.matcher)} из {self.path}")
+            except Exception as e:
+                logger.error(f"Ошибка загрузки списка запрещённых слов: {e}")
+        elif mtime is None and self._mtime is not None:
+            self.matcher = BannedWordMatcher(self.defaults)
+        self._mtime = mtime
+        self._next_check = time.monotonic() + self.check_interval
+        return len(self.matcher)
+
+    def find(self, text: str) -> Optional[str]:
+        if time.monotonic() >= self._next_check:
+            self.reload()
+        return self.matcher.find(text)
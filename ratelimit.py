@@ -0,0 +1,234 @@
+import time
+import heapq
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable, Union
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_USER = 0
+PRIORITY_CHANNEL = 1
+PRIORITY_ADMIN = 2
+# Фоновая уборка (посты истёкших анкет) — когда больше нечего отправлять
+PRIORITY_BACKGROUND = 3
+
+
+# ====== Token bucket ======
+# Для каждого ключа хранится только пара (токены, время обновления);
+# ключи, которые долго не трогали, удаляются, поэтому память растёт
+# с числом активных ключей, а не всех, кто когда-либо писал.
+class KeyedTokenBuckets:
+    def __init__(self, rate: float, capacity: float, idle_ttl: float = 600):
+        self.rate = rate
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self._buckets = {}
+        self._next_cleanup = time.monotonic() + idle_ttl
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def delay(self, key: Hashable, now: float = None) -> float:
+        # Сколько секунд ждать до появления токена (0 — можно сейчас)
+        now = time.monotonic() if now is None else now
+        tokens = self._tokens(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key: Hashable, now: float = None):
+        now = time.monotonic() if now is None else now
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        if now >= self._next_cleanup:
+            self._cleanup(now)
+
+    def try_acquire(self, key: Hashable, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        if self.delay(key, now) > 0:
+            return False
+        self.consume(key, now)
+        return True
+
+    def _cleanup(self, now: float):
+        # Через idle_ttl бездействия корзина всё равно полная — её можно забыть
+        stale = [key for key, (_, updated) in self._buckets.items() if now - updated > self.idle_ttl]
+        for key in stale:
+            del self._buckets[key]
+        self._next_cleanup = now + self.idle_ttl
+
+
+# ====== Очередь исходящих сообщений ======
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'make_request', 'future', 'attempts')
+
+    def __init__(self, priority, seq, chat_id, make_request, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.make_request = make_request
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# Все обращения к Bot API, которые отправляют сообщения, проходят через одну
+# очередь с приоритетами: ответы пользователям раньше постов в канал, а те
+# раньше уведомлений админу. Отправка ограничена общим лимитом бота, лимитом
+# на личный чат и более строгим лимитом на каналы/группы. RetryAfter ставит
+# всю очередь на паузу на указанное Telegram время, сетевые ошибки
+# повторяются с экспоненциальной задержкой.
+class OutboundScheduler:
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_per_minute: float = 20, group_burst: float = 5,
+                 concurrency: int = 8, max_retries: int = 3, backoff: float = 0.5):
+        self.global_bucket = KeyedTokenBuckets(global_rate, global_rate)
+        self.chat_buckets = KeyedTokenBuckets(chat_rate, chat_burst)
+        self.group_buckets = KeyedTokenBuckets(group_per_minute / 60, group_burst)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self._ready = []
+        self._delayed = []
+        self._seq = 0
+        self._paused_until = 0.0
+        self._wake = None
+        self._slots = None
+        self._task = None
+
+    def qsize(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        # Даём дослать то, что уже в очереди, но не дольше timeout
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self.qsize() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for _, job in self._delayed:
+            self._ready.append(job)
+        for job in self._ready:
+            if not job.future.done():
+                job.future.cancel()
+        self._ready, self._delayed = [], []
+
+    async def send(self, chat_id: Union[int, str], make_request: Callable[[], Awaitable[Any]],
+                   priority: int = PRIORITY_USER) -> Any:
+        # make_request — функция без аргументов, создающая корутину запроса;
+        # при повторе она вызывается заново
+        self.start()
+        self._seq += 1
+        job = _Job(priority, self._seq, chat_id, make_request, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._ready, job)
+        self._wake.set()
+        return await job.future
+
+    def _chat_buckets(self, chat_id) -> KeyedTokenBuckets:
+        # Каналы и группы: @username или отрицательный id
+        if isinstance(chat_id, str) or chat_id < 0:
+            return self.group_buckets
+        return self.chat_buckets
+
+    def _defer(self, job: _Job, delay: float):
+        heapq.heappush(self._delayed, (time.monotonic() + delay, job))
+        self._wake.set()
+
+    async def _sleep(self, timeout):
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._delayed)[1])
+
+            if not self._ready:
+                await self._sleep(self._delayed[0][0] - now if self._delayed else None)
+                continue
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            job = heapq.heappop(self._ready)
+            if job.future.done():
+                continue
+            buckets = self._chat_buckets(job.chat_id)
+            wait = buckets.delay(job.chat_id, now)
+            if wait > 0:
+                # Чат упёрся в свой лимит — откладываем только его сообщение
+                heapq.heappush(self._delayed, (now + wait, job))
+                continue
+            wait = self.global_bucket.delay(None, now)
+            if wait > 0:
+                heapq.heappush(self._ready, job)
+                await asyncio.sleep(wait)
+                continue
+
+            buckets.consume(job.chat_id, now)
+            self.global_bucket.consume(None, now)
+            await self._slots.acquire()
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+    async def _execute(self, job: _Job):
+        try:
+            result = await job.make_request()
+        except RetryAfter as e:
+            logger.warning(f"Flood control, пауза {e.retry_after} с (чат {job.chat_id})")
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            self.retries += 1
+            self._defer(job, e.retry_after)
+        except (BadRequest, Forbidden) as e:
+            self._fail(job, e)
+        except NetworkError as e:
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self._fail(job, e)
+            else:
+                self.retries += 1
+                self._defer(job, self.backoff * 2 ** (job.attempts - 1))
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, job: _Job, error: Exception):
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.qsize(),
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed
+        }
@@ -0,0 +1,502 @@
+import os
+import sys
+import time
+import sqlite3
+import logging
+import bisect
+import threading
+from itertools import islice
+from typing import Optional, List
+
+from search import PREFIX_END, tokenize
+from storage import Anket, Storage, WriteBehind, apply_record
+
+logger = logging.getLogger(__name__)
+
+
+# ====== Хранилище в памяти ======
+# Всё состояние держится в памяти (анкеты — в AnketStore), а изменения
+# пишутся в журнал через WriteBehind.
+class MemoryRepository:
+    def __init__(self, storage: Storage, interval: float = 1.0, batch_size: int = 500):
+        self.storage = storage
+        self.persistence = WriteBehind(storage, interval=interval, batch_size=batch_size)
+        # Состояние диалога (ждём анкету, ID для бана и т.п.) на диск не пишется
+        self.states = {}
+        # Ошибка загрузки не глушится: запуск с пустыми данными поверх
+        # непрочитанного снапшота потерял бы их, а warm_up отметит сбой в /health
+        self.data = storage.load()
+        # Индекс для /search строится сразу, а не на первом запросе
+        index = self.data['ankets'].search_index()
+        logger.info(f"Поисковый индекс: {len(index)} токенов")
+        self.persistence.start()
+
+    def _record(self, *mutation):
+        # Изменение применяется к данным в памяти сразу, а на диск
+        # уходит фоновым потоком вместе с соседними изменениями
+        apply_record(self.data, mutation)
+        self.persistence.submit(mutation)
+
+    def is_banned(self, user_id: int) -> bool:
+        return user_id in self.data['banned_users']
+
+    def ban(self, user_id: int):
+        self._record('ban', user_id)
+
+    def unban(self, user_id: int) -> bool:
+        if user_id not in self.data['banned_users']:
+            return False
+        self._record('unban', user_id)
+        return True
+
+    def has_anket(self, user_id: int) -> bool:
+        return user_id in self.data['ankets'].by_user
+
+    def get_user_anket(self, user_id: int) -> Optional[Anket]:
+        return self.data['ankets'].get_by_user(user_id)
+
+    def last_post_time(self, user_id: int) -> float:
+        return self.data['last_post_times'].get(user_id, 0)
+
+    def add_anket(self, user_id: int, url: str, comment: str) -> Anket:
+        anket = Anket(self.data['next_id'], user_id, url, comment, time.time())
+        self._record('add_anket', *anket[:5])
+        return anket
+
+    def try_add_anket(self, user_id: int, url: str, comment: str) -> Optional[Anket]:
+        # None, если у пользователя уже есть анкета. Проверка и добавление
+        # идут без await между ними, поэтому атомарны в event loop
+        if self.has_anket(user_id):
+            return None
+        return self.add_anket(user_id, url, comment)
+
+    def delete_user_anket(self, user_id: int) -> Optional[Anket]:
+        anket = self.get_user_anket(user_id)
+        if anket:
+            self._record('delete_user_anket', user_id)
+        return anket
+
+    def get_anket(self, anket_id: int) -> Optional[Anket]:
+        return self.data['ankets'].get(anket_id)
+
+    def delete_anket(self, anket_id: int) -> Optional[Anket]:
+        anket = self.get_anket(anket_id)
+        if anket:
+            self._record('delete_anket', anket_id)
+        return anket
+
+    def expire_ankets(self, anket_ids: List[int]) -> List[Anket]:
+        # Удаляет пачку истёкших анкет одной записью журнала и подрезает
+        # списки просмотров; возвращает те, что ещё существовали
+        ankets = self.data['ankets']
+        expired = [anket for anket in map(ankets.get, anket_ids) if anket is not None]
+        if expired:
+            self._record('expire', [anket.id for anket in expired])
+        return expired
+
+    def count_ankets(self) -> int:
+        return len(self.data['ankets'])
+
+    def list_ankets(self, offset: int = 0, limit: Optional[int] = None,
+                    after_id: int = 0, before_id: Optional[int] = None) -> List[Anket]:
+        # before_id — страница, ближайшая к курсору слева (в порядке id)
+        end = None if limit is None else offset + limit
+        if before_id is None:
+            return list(islice(self.data['ankets'].iter_from(after_id), offset, end))
+        ankets = self.data['ankets'].iter_before(before_id)
+        found = list(islice((anket for anket in ankets if anket.id > after_id), offset, end))
+        found.reverse()
+        return found
+
+    def unseen_ankets(self, user_id: int, offset: int, limit: int, after_id: int = 0,
+                      before_id: Optional[int] = None) -> List[Anket]:
+        # Идём по каталогу с курсора и параллельно по отсортированному
+        # списку просмотренных, так что стоимость зависит от размера
+        # страницы и числа пропущенных анкет, а не от всего каталога.
+        # С before_id то же самое в обратную сторону
+        viewed = self.data['viewed_ankets'].get(user_id, ())
+        found = []
+        if before_id is None:
+            viewed_pos = bisect.bisect_right(viewed, after_id)
+            for anket in self.data['ankets'].iter_from(after_id):
+                if len(found) >= offset + limit:
+                    break
+                while viewed_pos < len(viewed) and viewed[viewed_pos] < anket.id:
+                    viewed_pos += 1
+                if viewed_pos < len(viewed) and viewed[viewed_pos] == anket.id:
+                    continue
+                if anket.user_id != user_id:
+                    found.append(anket)
+            return found[offset:]
+
+        viewed_pos = bisect.bisect_left(viewed, before_id) - 1
+        for anket in self.data['ankets'].iter_before(before_id):
+            if len(found) >= offset + limit or anket.id <= after_id:
+                break
+            while viewed_pos >= 0 and viewed[viewed_pos] > anket.id:
+                viewed_pos -= 1
+            if viewed_pos >= 0 and viewed[viewed_pos] == anket.id:
+                continue
+            if anket.user_id != user_id:
+                found.append(anket)
+        found = found[offset:]
+        found.reverse()
+        return found
+
+    def search_ankets(self, words: List[str], limit: int, after_id: int = 0,
+                      user_id: Optional[int] = None) -> List[Anket]:
+        # Анкеты после after_id, где есть все слова запроса (по префиксу).
+        # С user_id — без его собственной и уже просмотренных им
+        ankets = self.data['ankets']
+        viewed = self.data['viewed_ankets'].get(user_id, ()) if user_id is not None else ()
+        found = []
+        for anket_id in ankets.search_index().match(tokenize(' '.join(words)), after_id):
+            if len(found) >= limit:
+                break
+            viewed_pos = bisect.bisect_left(viewed, anket_id)
+            if viewed_pos < len(viewed) and viewed[viewed_pos] == anket_id:
+                continue
+            anket = ankets.get(anket_id)
+            if anket is not None and anket.user_id != user_id:
+                found.append(anket)
+        return found
+
+    def mark_viewed(self, user_id: int, anket_id: int):
+        self._record('view', user_id, anket_id)
+
+    def set_channel_post(self, anket_id: int, message_id: int):
+        self._record('anket_channel_post', anket_id, message_id)
+
+    def set_state(self, user_id: int, state: str):
+        self.states[user_id] = state
+
+    def get_state(self, user_id: int) -> Optional[str]:
+        return self.states.get(user_id)
+
+    def pop_state(self, user_id: int, state: str) -> bool:
+        # Снимает состояние, только если оно равно state
+        if self.states.get(user_id) != state:
+            return False
+        del self.states[user_id]
+        return True
+
+    def close(self):
+        self.persistence.stop()
+
+
+# ====== SQLite ======
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ankets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    comment TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    channel_message_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS ankets_user_id ON ankets(user_id);
+
+CREATE TABLE IF NOT EXISTS views (
+    user_id INTEGER NOT NULL,
+    anket_id INTEGER NOT NULL REFERENCES ankets(id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, anket_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS views_anket_id ON views(anket_id);
+
+CREATE TABLE IF NOT EXISTS banned_users (
+    user_id INTEGER PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS last_post_times (
+    user_id INTEGER PRIMARY KEY,
+    time REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_states (
+    user_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS anket_tokens (
+    token TEXT NOT NULL,
+    anket_id INTEGER NOT NULL REFERENCES ankets(id) ON DELETE CASCADE,
+    PRIMARY KEY (token, anket_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS anket_tokens_anket_id ON anket_tokens(anket_id);
+"""
+
+ANKET_COLUMNS = "id, user_id, url, comment, created_at, channel_message_id"
+# Анкета не своя и ещё не просмотрена; параметры — user_id дважды
+UNSEEN = ("a.user_id != ? AND NOT EXISTS "
+          "(SELECT 1 FROM views v WHERE v.user_id = ? AND v.anket_id = a.id)")
+
+
+# Данные лежат в индексированных таблицах и не читаются в память целиком:
+# проверки кулдауна и выборка непросмотренных анкет — это запросы по индексам.
+# Каждое изменение — отдельная транзакция, WAL позволяет читать параллельно.
+class SqliteRepository:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        self._build_search_index()
+
+    def _upgrade_schema(self):
+        # Раньше посты в канале лежали в отдельной таблице по user_id
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(ankets)")}
+        if 'channel_message_id' in columns:
+            return
+        with self._conn:
+            self._conn.execute("ALTER TABLE ankets ADD COLUMN channel_message_id INTEGER")
+            self._conn.execute(
+                "UPDATE ankets SET channel_message_id = "
+                "(SELECT message_id FROM channel_posts p WHERE p.user_id = ankets.user_id)")
+            self._conn.execute("DROP TABLE channel_posts")
+
+    def _build_search_index(self):
+        # Базы, созданные до поиска (или перенесённые из pickle), индексируются
+        # один раз при открытии; дальше токены пишутся вместе с анкетой
+        if self._conn.execute("SELECT 1 FROM anket_tokens LIMIT 1").fetchone():
+            return
+        rows = self._conn.execute("SELECT id, comment FROM ankets").fetchall()
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO anket_tokens (token, anket_id) VALUES (?, ?)",
+                                   ((token, anket_id) for anket_id, comment in rows
+                                    for token in tokenize(comment)))
+        logger.info(f"Поисковый индекс построен для {len(rows)} анкет")
+
+    def _index_anket(self, anket_id: int, comment: str):
+        # Вызывается внутри транзакции добавления анкеты
+        self._conn.executemany("INSERT OR IGNORE INTO anket_tokens (token, anket_id) VALUES (?, ?)",
+                               [(token, anket_id) for token in tokenize(comment)])
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def is_banned(self, user_id: int) -> bool:
+        return bool(self._query("SELECT 1 FROM banned_users WHERE user_id = ?", (user_id,)))
+
+    def ban(self, user_id: int):
+        self._execute("INSERT OR IGNORE INTO banned_users (user_id) VALUES (?)", (user_id,))
+
+    def unban(self, user_id: int) -> bool:
+        return self._execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,)).rowcount > 0
+
+    def has_anket(self, user_id: int) -> bool:
+        return bool(self._query("SELECT 1 FROM ankets WHERE user_id = ? LIMIT 1", (user_id,)))
+
+    def get_user_anket(self, user_id: int) -> Optional[Anket]:
+        rows = self._query(
+            f"SELECT {ANKET_COLUMNS} FROM ankets WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,))
+        return Anket(*rows[0]) if rows else None
+
+    def last_post_time(self, user_id: int) -> float:
+        rows = self._query("SELECT time FROM last_post_times WHERE user_id = ?", (user_id,))
+        return rows[0][0] if rows else 0
+
+    def add_anket(self, user_id: int, url: str, comment: str) -> Anket:
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO ankets (user_id, url, comment, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, url, comment, now))
+            self._index_anket(cursor.lastrowid, comment)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO last_post_times (user_id, time) VALUES (?, ?)",
+                (user_id, now))
+        return Anket(cursor.lastrowid, user_id, url, comment, now)
+
+    def try_add_anket(self, user_id: int, url: str, comment: str) -> Optional[Anket]:
+        # BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому проверка и
+        # вставка атомарны и между процессами: два одновременных сообщения
+        # не добавят пользователю две анкеты
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if self._conn.execute("SELECT 1 FROM ankets WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                return None
+            cursor = self._conn.execute(
+                "INSERT INTO ankets (user_id, url, comment, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, url, comment, now))
+            self._index_anket(cursor.lastrowid, comment)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO last_post_times (user_id, time) VALUES (?, ?)",
+                (user_id, now))
+        return Anket(cursor.lastrowid, user_id, url, comment, now)
+
+    def delete_user_anket(self, user_id: int) -> Optional[Anket]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"SELECT {ANKET_COLUMNS} FROM ankets WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+                (user_id,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM ankets WHERE user_id = ?", (user_id,))
+            self._conn.execute("DELETE FROM last_post_times WHERE user_id = ?", (user_id,))
+        return Anket(*row)
+
+    def get_anket(self, anket_id: int) -> Optional[Anket]:
+        rows = self._query(f"SELECT {ANKET_COLUMNS} FROM ankets WHERE id = ?", (anket_id,))
+        return Anket(*rows[0]) if rows else None
+
+    def delete_anket(self, anket_id: int) -> Optional[Anket]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"SELECT {ANKET_COLUMNS} FROM ankets WHERE id = ?", (anket_id,)).fetchone()
+            if row is None:
+                return None
+            anket = Anket(*row)
+            self._conn.execute("DELETE FROM ankets WHERE id = ?", (anket_id,))
+            self._conn.execute("DELETE FROM last_post_times WHERE user_id = ?", (anket.user_id,))
+        return anket
+
+    def expire_ankets(self, anket_ids: List[int]) -> List[Anket]:
+        # Просмотры и токены уходят каскадом. Одни и те же id могут снимать
+        # несколько воркеров: RETURNING отдаёт анкету только тому, кто её удалил
+        if not anket_ids:
+            return []
+        marks = ",".join("?" * len(anket_ids))
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"DELETE FROM ankets WHERE id IN ({marks}) RETURNING {ANKET_COLUMNS}", anket_ids).fetchall()
+            self._conn.executemany("DELETE FROM last_post_times WHERE user_id = ?", [(row[1],) for row in rows])
+        return [Anket(*row) for row in rows]
+
+    def count_ankets(self) -> int:
+        return self._query("SELECT COUNT(*) FROM ankets")[0][0]
+
+    def list_ankets(self, offset: int = 0, limit: Optional[int] = None,
+                    after_id: int = 0, before_id: Optional[int] = None) -> List[Anket]:
+        if before_id is None:
+            rows = self._query(
+                f"SELECT {ANKET_COLUMNS} FROM ankets WHERE id > ? ORDER BY id LIMIT ? OFFSET ?",
+                (after_id, -1 if limit is None else limit, offset))
+            return [Anket(*row) for row in rows]
+        rows = self._query(
+            f"SELECT {ANKET_COLUMNS} FROM ankets WHERE id > ? AND id < ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (after_id, before_id, -1 if limit is None else limit, offset))
+        return [Anket(*row) for row in reversed(rows)]
+
+    def unseen_ankets(self, user_id: int, offset: int, limit: int, after_id: int = 0,
+                      before_id: Optional[int] = None) -> List[Anket]:
+        if before_id is None:
+            rows = self._query(
+                f"SELECT {ANKET_COLUMNS} FROM ankets a WHERE a.id > ? AND {UNSEEN} "
+                "ORDER BY a.id LIMIT ? OFFSET ?",
+                (after_id, user_id, user_id, limit, offset))
+            return [Anket(*row) for row in rows]
+        # Назад по курсору — тот же обход первичного ключа в обратном порядке
+        rows = self._query(
+            f"SELECT {ANKET_COLUMNS} FROM ankets a WHERE a.id > ? AND a.id < ? AND {UNSEEN} "
+            "ORDER BY a.id DESC LIMIT ? OFFSET ?",
+            (after_id, before_id, user_id, user_id, limit, offset))
+        return [Anket(*row) for row in reversed(rows)]
+
+    def search_ankets(self, words: List[str], limit: int, after_id: int = 0,
+                      user_id: Optional[int] = None) -> List[Anket]:
+        # Каждое слово — диапазон токенов по индексу (token, anket_id)
+        tokens = tokenize(' '.join(words))
+        if not tokens:
+            return []
+        conditions = ["a.id > ?"]
+        params = [after_id]
+        for token in tokens:
+            conditions.append("a.id IN (SELECT anket_id FROM anket_tokens WHERE token >= ? AND token < ?)")
+            params += [token, token + PREFIX_END]
+        if user_id is not None:
+            conditions.append(UNSEEN)
+            params += [user_id, user_id]
+        rows = self._query(
+            f"SELECT {ANKET_COLUMNS} FROM ankets a WHERE {' AND '.join(conditions)} ORDER BY a.id LIMIT ?",
+            (*params, limit))
+        return [Anket(*row) for row in rows]
+
+    def mark_viewed(self, user_id: int, anket_id: int):
+        # Анкету могли удалить, пока её показывали: тогда просмотр просто
+        # не пишется, а не падает на внешнем ключе
+        self._execute("INSERT OR IGNORE INTO views (user_id, anket_id) "
+                      "SELECT ?, ? WHERE EXISTS (SELECT 1 FROM ankets WHERE id = ?)",
+                      (user_id, anket_id, anket_id))
+
+    def set_channel_post(self, anket_id: int, message_id: int):
+        self._execute("UPDATE ankets SET channel_message_id = ? WHERE id = ?", (message_id, anket_id))
+
+    # Состояние диалога хранится в базе, чтобы следующее сообщение
+    # пользователя понял и другой процесс
+    def set_state(self, user_id: int, state: str):
+        self._execute("INSERT OR REPLACE INTO user_states (user_id, state) VALUES (?, ?)", (user_id, state))
+
+    def get_state(self, user_id: int) -> Optional[str]:
+        rows = self._query("SELECT state FROM user_states WHERE user_id = ?", (user_id,))
+        return rows[0][0] if rows else None
+
+    def pop_state(self, user_id: int, state: str) -> bool:
+        return self._execute("DELETE FROM user_states WHERE user_id = ? AND state = ?",
+                             (user_id, state)).rowcount > 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ====== Миграция из bot_data.pkl ======
+def migrate_pickle_to_sqlite(snapshot_path: str, journal_path: str, db_path: str) -> int:
+    storage = Storage(snapshot_path, journal_path)
+    data = storage.load()
+    storage.close()
+    repo = SqliteRepository(db_path)
+    if repo.count_ankets():
+        repo.close()
+        raise RuntimeError(f"База {db_path} уже содержит анкеты")
+
+    ankets = list(data['ankets'])
+    with repo._lock, repo._conn as conn:
+        # id анкет переносятся как есть, поэтому просмотры остаются валидными
+        conn.executemany(
+            f"INSERT INTO ankets ({ANKET_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            ankets)
+        conn.executemany(
+            "INSERT OR IGNORE INTO views (user_id, anket_id) "
+            "SELECT ?, ? WHERE EXISTS (SELECT 1 FROM ankets WHERE id = ?)",
+            [(user_id, anket_id, anket_id)
+             for user_id, viewed in data['viewed_ankets'].items()
+             for anket_id in viewed])
+        conn.executemany("INSERT OR IGNORE INTO anket_tokens (token, anket_id) VALUES (?, ?)",
+                         [(token, anket.id) for anket in ankets for token in tokenize(anket.comment)])
+        conn.executemany("INSERT OR IGNORE INTO banned_users (user_id) VALUES (?)",
+                         [(user_id,) for user_id in data['banned_users']])
+        conn.executemany("INSERT OR REPLACE INTO last_post_times (user_id, time) VALUES (?, ?)",
+                         list(data['last_post_times'].items()))
+        # Счётчик AUTOINCREMENT продолжается с next_id, а не с наибольшего
+        # живого id: id удалённых анкет не должны достаться новым, на них
+        # ещё ссылаются кнопки и курсоры в старых сообщениях
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'ankets'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('ankets', ?)", (data['next_id'] - 1,))
+    repo.close()
+    return len(ankets)
+
+
+if __name__ == '__main__':
+    # python repository.py bot_data.pkl bot_data.journal bot_data.db
+    if len(sys.argv) != 4:
+        print("Использование: python repository.py <bot_data.pkl> <bot_data.journal> <bot_data.db>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    snapshot_path, journal_path, db_path = sys.argv[1:]
+    if not os.path.exists(snapshot_path):
+        print(f"Файл {snapshot_path} не найден")
+        sys.exit(1)
+    count = migrate_pickle_to_sqlite(snapshot_path, journal_path, db_path)
+    print(f"Перенесено анкет: {count}")
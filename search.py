@@ -0,0 +1,89 @@
+import re
+import bisect
+from array import array
+from typing import Dict, Iterable, Iterator, List
+
+WORD = re.compile(r'\w+')
+# Одиночные буквы и цифры в индекс не попадают: их списки были бы размером с каталог
+MIN_TOKEN_LENGTH = 2
+# Верхняя граница диапазона токенов с заданным префиксом
+PREFIX_END = '\U0010ffff'
+
+
+def tokenize(text: str) -> List[str]:
+    # Слова в нижнем регистре, ё -> е, без повторов, в порядке появления
+    words = WORD.findall(text.lower().replace('ё', 'е'))
+    return list(dict.fromkeys(word for word in words if len(word) >= MIN_TOKEN_LENGTH))
+
+
+# ====== Инвертированный индекс ======
+# Токен -> отсортированный array('I') с id анкет, где он встречается, и
+# отсортированный список самих токенов: слово запроса находит все токены
+# со своим префиксом двумя bisect. Слова запроса объединяются по И: из
+# списков берётся самый короткий, и каждый его id ищется в остальных
+# bisect'ом, так что время зависит от длины списков, а не от каталога.
+class SearchIndex:
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.tokens: List[str] = []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, anket_id: int, text: str):
+        for token in tokenize(text):
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = array('I')
+                bisect.insort(self.tokens, token)
+            # id растут, поэтому почти всегда это дописывание в конец
+            if not ids or ids[-1] < anket_id:
+                ids.append(anket_id)
+                continue
+            pos = bisect.bisect_left(ids, anket_id)
+            if ids[pos] != anket_id:
+                ids.insert(pos, anket_id)
+
+    def remove(self, anket_id: int, text: str):
+        for token in tokenize(text):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            pos = bisect.bisect_left(ids, anket_id)
+            if pos < len(ids) and ids[pos] == anket_id:
+                del ids[pos]
+            if not ids:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def expand(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + PREFIX_END, start)
+        return self.tokens[start:end]
+
+    def match(self, words: Iterable[str], after_id: int = 0) -> Iterator[int]:
+        # id анкет больше after_id по возрастанию, в которых каждое слово
+        # запроса — префикс какого-нибудь токена. Генератор: странице из
+        # нескольких анкет не нужно пересекать списки целиком
+        lists = []
+        for word in words:
+            tokens = self.expand(word)
+            if not tokens:
+                return
+            if len(tokens) == 1:
+                lists.append(self.postings[tokens[0]])
+            else:
+                lists.append(sorted(set().union(*(self.postings[token] for token in tokens))))
+        if not lists:
+            return
+        lists.sort(key=len)
+        first, others = lists[0], lists[1:]
+        for pos in range(bisect.bisect_right(first, after_id), len(first)):
+            anket_id = first[pos]
+            if all(_contains(ids, anket_id) for ids in others):
+                yield anket_id
+
+
+def _contains(ids, anket_id: int) -> bool:
+    pos = bisect.bisect_left(ids, anket_id)
+    return pos < len(ids) and ids[pos] == anket_id
@@ -0,0 +1,562 @@
+import os
+import pickle
+import shutil
+import struct
+import zlib
+import bisect
+import logging
+import threading
+from array import array
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Заголовок записи журнала: длина полезной нагрузки и её CRC32
+RECORD_HEADER = struct.Struct('<II')
+
+# Версия формата данных. В версии 1 анкеты адресовались позицией в
+# ankets_list, в версии 2 получили постоянные возрастающие id, с версии 3
+# анкеты, их владельцы и посты в канале хранятся в одном AnketStore.
+DATA_VERSION = 3
+
+
+class Anket(NamedTuple):
+    id: int
+    user_id: int
+    url: str
+    comment: str
+    time: float
+    channel_message_id: Optional[int] = None
+
+
+# ====== Каталог анкет ======
+# by_id — id -> Anket в порядке публикации (id только растут, поэтому порядок
+# вставки в dict совпадает с порядком id), by_user — user_id -> id.
+# Добавление и удаление — O(1). Для продолжения с курсора рядом лежит
+# возрастающий массив id; удалённые id остаются в нём, пока их не станет
+# больше живых, после чего массив пересобирается (амортизированно O(1)).
+# Поисковый индекс по комментариям в снапшот не пишется: он строится при
+# первом обращении и дальше обновляется вместе с каталогом.
+class AnketStore:
+    def __init__(self):
+        self.by_id = {}
+        self.by_user = {}
+        self._ids = array('I')
+        self._index = None
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __getstate__(self):
+        return {'by_id': self.by_id, 'by_user': self.by_user}
+
+    def __setstate__(self, state):
+        self.by_id = state['by_id']
+        self.by_user = state['by_user']
+        self._ids = array('I', self.by_id)
+        self._index = None
+
+    def get(self, anket_id: int) -> Optional[Anket]:
+        return self.by_id.get(anket_id)
+
+    def get_by_user(self, user_id: int) -> Optional[Anket]:
+        anket_id = self.by_user.get(user_id)
+        return None if anket_id is None else self.by_id.get(anket_id)
+
+    def add(self, anket: Anket):
+        self.by_id[anket.id] = anket
+        self.by_user[anket.user_id] = anket.id
+        self._ids.append(anket.id)
+        if self._index is not None:
+            self._index.add(anket.id, anket.comment)
+
+    def update(self, anket: Anket):
+        if anket.id in self.by_id:
+            self.by_id[anket.id] = anket
+
+    def remove(self, anket_id: int) -> Optional[Anket]:
+        anket = self.by_id.pop(anket_id, None)
+        if anket is None:
+            return None
+        if self.by_user.get(anket.user_id) == anket_id:
+            del self.by_user[anket.user_id]
+        if self._index is not None:
+            self._index.remove(anket_id, anket.comment)
+        if len(self._ids) > 2 * len(self.by_id) + 64:
+            self._ids = array('I', self.by_id)
+        return anket
+
+    def first_id(self) -> Optional[int]:
+        # Наименьший живой id; удалённые id в начале массива отрезаются
+        ids = self._ids
+        pos = 0
+        while pos < len(ids) and ids[pos] not in self.by_id:
+            pos += 1
+        if pos:
+            del ids[:pos]
+        return ids[0] if ids else None
+
+    def search_index(self) -> SearchIndex:
+        if self._index is None:
+            index = SearchIndex()
+            for anket in self.by_id.values():
+                index.add(anket.id, anket.comment)
+            self._index = index
+        return self._index
+
+    def iter_from(self, after_id: int = 0):
+        ids = self._ids
+        pos = bisect.bisect_right(ids, after_id)
+        while pos < len(ids):
+            anket = self.by_id.get(ids[pos])
+            pos += 1
+            if anket is not None:
+                yield anket
+
+    def iter_before(self, before_id: int):
+        # В обратном порядке, начиная с ближайшей анкеты с id < before_id
+        ids = self._ids
+        pos = bisect.bisect_left(ids, before_id)
+        while pos > 0:
+            pos -= 1
+            anket = self.by_id.get(ids[pos])
+            if anket is not None:
+                yield anket
+
+
+# viewed_ankets — user_id -> отсортированный array('I') с id просмотренных
+# анкет (4 байта на просмотр)
+def empty_data():
+    return {
+        'version': DATA_VERSION,
+        'next_id': 1,
+        'ankets': AnketStore(),
+        'banned_users': set(),
+        'viewed_ankets': {},
+        'last_post_times': {}
+    }
+
+
+def _remove_anket(data, anket_id: int):
+    anket = data['ankets'].remove(anket_id)
+    if anket:
+        data['last_post_times'].pop(anket.user_id, None)
+
+
+def _prune_viewed(data):
+    # Анкеты истекают от старых к новым, поэтому всё, что меньше самого
+    # старого живого id, из списков просмотров можно отрезать целиком
+    floor = data['ankets'].first_id() or data['next_id']
+    viewed_ankets = data['viewed_ankets']
+    for user_id in list(viewed_ankets):
+        viewed = viewed_ankets[user_id]
+        cut = bisect.bisect_left(viewed, floor)
+        if cut == len(viewed):
+            del viewed_ankets[user_id]
+        elif cut:
+            del viewed[:cut]
+
+
+# ====== Применение изменений ======
+def apply_record(data, record):
+    op, *args = record
+    ankets = data['ankets']
+
+    if op == 'add_anket':
+        anket_id, user_id, url, comment, ts = args
+        ankets.add(Anket(anket_id, user_id, url, comment, ts))
+        data['last_post_times'][user_id] = ts
+        data['next_id'] = max(data['next_id'], anket_id + 1)
+
+    elif op == 'delete_user_anket':
+        user_id, = args
+        if user_id in ankets.by_user:
+            _remove_anket(data, ankets.by_user[user_id])
+
+    elif op == 'delete_anket':
+        anket_id, = args
+        _remove_anket(data, anket_id)
+
+    elif op == 'expire':
+        anket_ids, = args
+        for anket_id in anket_ids:
+            _remove_anket(data, anket_id)
+        _prune_viewed(data)
+
+    elif op == 'anket_channel_post':
+        anket_id, message_id = args
+        anket = ankets.get(anket_id)
+        if anket:
+            ankets.update(anket._replace(channel_message_id=message_id))
+
+    # channel_post и channel_post_deleted остались от журналов версии 2,
+    # где пост в канале был привязан к пользователю, а не к анкете
+    elif op == 'channel_post':
+        user_id, message_id = args
+        anket = ankets.get_by_user(user_id)
+        if anket:
+            ankets.update(anket._replace(channel_message_id=message_id))
+
+    elif op == 'channel_post_deleted':
+        user_id, = args
+        anket = ankets.get_by_user(user_id)
+        if anket:
+            ankets.update(anket._replace(channel_message_id=None))
+
+    elif op == 'ban':
+        user_id, = args
+        data['banned_users'].add(user_id)
+
+    elif op == 'unban':
+        user_id, = args
+        data['banned_users'].discard(user_id)
+
+    elif op == 'view':
+        user_id, anket_id = args
+        viewed = data['viewed_ankets'].setdefault(user_id, array('I'))
+        pos = bisect.bisect_left(viewed, anket_id)
+        if pos == len(viewed) or viewed[pos] != anket_id:
+            viewed.insert(pos, anket_id)
+
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {op}")
+
+
+# ====== Формат версии 1 ======
+# Нужен только чтобы дочитать старый снапшот с журналом и перевести их
+# в текущий формат: id анкеты = позиция в ankets_list + 1. Записи версии 2
+# совместимы с текущими, поэтому для них отдельной функции нет.
+def apply_legacy_record(data, record):
+    op, *args = record
+
+    if op == 'add_anket':
+        user_id, url, comment, ts = args
+        data['user_ankets'][user_id] = {'url': url, 'comment': comment, 'time': ts}
+        data['ankets_list'].append((user_id, url, comment))
+        data['last_post_times'][user_id] = ts
+
+    elif op == 'delete_user_anket':
+        user_id, = args
+        data['user_ankets'].pop(user_id, None)
+        data['ankets_list'][:] = [a for a in data['ankets_list'] if a[0] != user_id]
+        data['last_post_times'].pop(user_id, None)
+
+    elif op == 'delete_anket_at':
+        idx, = args
+        user_id, _, _ = data['ankets_list'].pop(idx)
+        data['user_ankets'].pop(user_id, None)
+        data['last_post_times'].pop(user_id, None)
+
+    elif op == 'view':
+        user_id, idx = args
+        data['viewed_ankets'][user_id].add(idx)
+
+    elif op == 'channel_post':
+        user_id, message_id = args
+        data['channel_posts'][user_id] = message_id
+
+    elif op == 'channel_post_deleted':
+        user_id, = args
+        data['channel_posts'].pop(user_id, None)
+
+    elif op == 'ban':
+        user_id, = args
+        data['banned_users'].add(user_id)
+
+    elif op == 'unban':
+        user_id, = args
+        data['banned_users'].discard(user_id)
+
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {op}")
+
+
+def upgrade_data(data):
+    version = data.get('version', 1)
+    if version == 1:
+        ankets_list = data.get('ankets_list', [])
+        user_ankets = data.get('user_ankets', {})
+        data = {
+            'version': 2,
+            'next_id': len(ankets_list) + 1,
+            'ankets_list': [(idx + 1, user_id, url, comment, user_ankets.get(user_id, {}).get('time', 0))
+                            for idx, (user_id, url, comment) in enumerate(ankets_list)],
+            'user_ankets': {user_id: idx + 1 for idx, (user_id, _, _) in enumerate(ankets_list)
+                            if user_id in user_ankets},
+            'viewed_ankets': {user_id: array('I', sorted(idx + 1 for idx in viewed
+                                                         if 0 <= idx < len(ankets_list)))
+                              for user_id, viewed in data.get('viewed_ankets', {}).items()},
+            'banned_users': set(data.get('banned_users', ())),
+            'last_post_times': dict(data.get('last_post_times', {})),
+            'channel_posts': dict(data.get('channel_posts', {}))
+        }
+
+    if data['version'] == 2:
+        ankets = AnketStore()
+        owners = {anket_id: user_id for user_id, anket_id in data['user_ankets'].items()}
+        for anket_id, user_id, url, comment, created in data['ankets_list']:
+            # Пост в канале в версии 2 принадлежал пользователю, то есть его текущей анкете
+            message_id = data['channel_posts'].get(user_id) if owners.get(anket_id) == user_id else None
+            ankets.add(Anket(anket_id, user_id, url, comment, created, message_id))
+        ankets.by_user = {user_id: anket_id for anket_id, user_id in owners.items()
+                          if anket_id in ankets.by_id}
+        data = {
+            'version': 3,
+            'next_id': data['next_id'],
+            'ankets': ankets,
+            'banned_users': data['banned_users'],
+            'viewed_ankets': data['viewed_ankets'],
+            'last_post_times': data['last_post_times']
+        }
+    return data
+
+
+# ====== Снапшот + журнал ======
+# Каждое изменение дописывается в журнал отдельной записью с порядковым
+# номером, поэтому стоимость записи не зависит от объёма данных. Когда
+# журнал вырастает до compact_every записей, он сворачивается в новый
+# снапшот, а журнал обнуляется. Сворачивание работает только с файлами
+# и не трогает данные в памяти, поэтому его можно выполнять в фоне.
+class Storage:
+    def __init__(self, snapshot_path: str, journal_path: str, compact_every: int = 1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.seq = 0
+        self.pending = 0
+        self._journal = None
+
+    def load(self):
+        data, self.seq, replayed, version = self._replay()
+        self.pending = replayed
+        if version < DATA_VERSION:
+            # Старый формат сразу сворачиваем в снапшот нового,
+            # чтобы дальше журнал содержал только записи с id. Исходные
+            # файлы перед этим откладываются рядом с суффиксом версии
+            self._backup(version)
+            self._write_snapshot(data, self.seq)
+            self._journal = open(self.journal_path, "wb")
+            self.pending = 0
+            logger.info(f"Данные переведены в формат версии {DATA_VERSION}")
+        else:
+            self._journal = open(self.journal_path, "ab")
+        logger.info(f"Данные загружены: снапшот + {replayed} записей журнала")
+        return data
+
+    def _backup(self, version: int):
+        # Копия не перезаписывается: если перевод прервётся и запустится
+        # снова, в ней останутся самые первые исходные данные
+        for path in (self.snapshot_path, self.journal_path):
+            backup_path = f"{path}.v{version}"
+            if os.path.exists(path) and not os.path.exists(backup_path):
+                shutil.copy2(path, backup_path)
+                logger.info(f"Копия данных версии {version}: {backup_path}")
+
+    def append_many(self, records):
+        # seq и pending сдвигаются только после успешной записи: при ошибке
+        # те же записи можно дописать повторно с теми же номерами
+        if self._journal is None:
+            self._journal = open(self.journal_path, "ab")
+        seq = self.seq
+        chunks = []
+        for record in records:
+            seq += 1
+            payload = pickle.dumps((seq, record), protocol=pickle.HIGHEST_PROTOCOL)
+            chunks.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            chunks.append(payload)
+        offset = self._journal.tell()
+        try:
+            self._journal.write(b''.join(chunks))
+            self._journal.flush()
+        except Exception:
+            self._rollback(offset)
+            raise
+        self.seq = seq
+        self.pending += len(records)
+
+    def _rollback(self, offset: int):
+        # Недописанная пачка обрезается, чтобы следующая легла сразу за
+        # последней целой записью, а не за битым хвостом, на котором
+        # остановится чтение журнала
+        journal, self._journal = self._journal, None
+        try:
+            journal.close()
+        except Exception:
+            pass
+        try:
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(offset)
+            self._journal = open(self.journal_path, "ab")
+        except Exception as e:
+            logger.error(f"Не удалось восстановить журнал после ошибки записи: {e}")
+
+    def needs_compaction(self) -> bool:
+        return self.pending >= self.compact_every
+
+    def compact(self):
+        # Новый снапшот собирается из старого снапшота и журнала заново,
+        # а не из живых данных, которые в это время меняют обработчики
+        data, seq, _, _ = self._replay()
+        self._write_snapshot(data, seq)
+
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self.journal_path, "wb")
+        self.pending = 0
+
+    def close(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def _replay(self):
+        data, seq = self._read_snapshot()
+        version = data.get('version', 1)
+        upgraded = version < DATA_VERSION
+        legacy = version == 1
+        apply = apply_legacy_record if legacy else apply_record
+        if legacy:
+            # Журнал версии 1 применяется к данным версии 1 и только потом
+            # всё вместе переводится в текущий формат
+            data.setdefault('user_ankets', {})
+            data.setdefault('ankets_list', [])
+            data.setdefault('last_post_times', {})
+            data.setdefault('channel_posts', {})
+            data.setdefault('banned_users', set())
+            data['viewed_ankets'] = defaultdict(set, data.get('viewed_ankets', {}))
+        elif upgraded:
+            data = upgrade_data(data)
+
+        replayed = 0
+        for record_seq, record in self._read_journal():
+            if record_seq <= seq:
+                continue
+            try:
+                apply(data, record)
+            except Exception as e:
+                logger.error(f"Ошибка применения записи журнала #{record_seq}: {e}")
+            seq = record_seq
+            replayed += 1
+
+        if legacy:
+            data = upgrade_data(data)
+        return data, seq, replayed, version
+
+    def _write_snapshot(self, data, seq: int):
+        # Снапшот пишется во временный файл и атомарно подменяет старый,
+        # так что прерванная запись не портит уже сохранённые данные
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({'seq': seq, 'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return empty_data(), 0
+        with open(self.snapshot_path, "rb") as f:
+            raw = pickle.load(f)
+        # bot_data.pkl старого формата — это просто словарь с данными
+        if 'seq' not in raw:
+            return raw, 0
+        return raw['data'], raw['seq']
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        good_offset = 0
+        with open(self.journal_path, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                good_offset = f.tell()
+                yield pickle.loads(payload)
+
+        # Отбрасываем недописанный хвост, чтобы новые записи шли после целых
+        if good_offset < os.path.getsize(self.journal_path):
+            logger.warning(f"Журнал обрезан до последней целой записи ({good_offset} байт)")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_offset)
+
+
+# ====== Фоновая запись ======
+# Обработчики только ставят изменения в буфер, а отдельный фоновый поток
+# дописывает их в журнал пачкой не чаще раза в interval секунд (или раньше,
+# если набралось batch_size записей). Так event loop не ждёт диск, а всплеск
+# кликов превращается в одну запись вместо сотен. Поток демонический,
+# поэтому остаток буфера при остановке обязательно сбрасывается через stop().
+class WriteBehind:
+    def __init__(self, storage: Storage, interval: float = 1.0, batch_size: int = 500):
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="persistence", daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        with self._lock:
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            try:
+                self.storage.append_many(batch)
+            except Exception:
+                # Пачка возвращается в начало буфера и уйдёт следующим flush
+                with self._lock:
+                    self._buffer[:0] = batch
+                raise
+        if self.storage.needs_compaction():
+            self.storage.compact()
+
+    def stop(self, compact: bool = True):
+        # Останавливаем поток и синхронно сбрасываем остаток буфера
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if compact:
+            self.storage.compact()
+        self.storage.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи данных: {e}")
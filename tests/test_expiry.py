@@ -0,0 +1,149 @@
+import time
+import asyncio
+
+import pytest
+
+from expiry import ExpirySweeper
+from repository import MemoryRepository, SqliteRepository
+from storage import Storage
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def repo(request, tmp_path):
+    if request.param == 'memory':
+        repo = MemoryRepository(Storage(str(tmp_path / "bot_data.pkl"), str(tmp_path / "bot_data.journal")))
+    else:
+        repo = SqliteRepository(str(tmp_path / "bot.db"))
+    yield repo
+    repo.close()
+
+
+def viewed(repo):
+    # user_id -> id просмотренных анкет в любом из хранилищ
+    if isinstance(repo, MemoryRepository):
+        return {user_id: list(ids) for user_id, ids in repo.data['viewed_ankets'].items()}
+    found = {}
+    for user_id, anket_id in repo._query("SELECT user_id, anket_id FROM views ORDER BY user_id, anket_id"):
+        found.setdefault(user_id, []).append(anket_id)
+    return found
+
+
+def fill(repo, count):
+    return [repo.add_anket(user_id, f"https://forms.gle/{user_id}", "кино") for user_id in range(1, count + 1)]
+
+
+async def ignore(ankets):
+    pass
+
+
+def test_load_and_schedule(repo):
+    ankets = fill(repo, 5)
+    sweeper = ExpirySweeper(repo, ttl=100, on_expired=ignore)
+    assert sweeper.load(page_size=2) == 5
+    anket = repo.add_anket(6, "https://forms.gle/6", "кино")
+    sweeper.schedule(anket)
+    assert len(sweeper) == 6
+    assert sweeper.sweep(ankets[0].time + 99) == []
+    assert len(repo.list_ankets()) == 6
+
+
+def test_sweep_in_batches_skipping_deleted(repo):
+    ankets = fill(repo, 7)
+    sweeper = ExpirySweeper(repo, ttl=10, on_expired=ignore, batch_size=3)
+    sweeper.load()
+    repo.delete_user_anket(2)
+    repo.delete_anket(ankets[4].id)
+
+    now = time.time() + 20
+    batches = []
+    while True:
+        expired = sweeper.sweep(now)
+        if not expired and not len(sweeper):
+            break
+        batches.append([anket.id for anket in expired])
+    # Удалённые раньше срока занимают место в пачке, но наружу не попадают
+    assert batches == [[1, 3], [4, 6], [7]]
+    assert sweeper.expired == 5
+    assert repo.count_ankets() == 0
+
+
+def test_repository_error_keeps_ids(repo):
+    fill(repo, 3)
+    sweeper = ExpirySweeper(repo, ttl=10, on_expired=ignore)
+    sweeper.load()
+    expire = repo.expire_ankets
+    repo.expire_ankets = lambda ids: (_ for _ in ()).throw(OSError("disk full"))
+    now = time.time() + 20
+    with pytest.raises(OSError):
+        sweeper.sweep(now)
+    assert len(sweeper) == 3
+
+    repo.expire_ankets = expire
+    assert [anket.id for anket in sweeper.sweep(now)] == [1, 2, 3]
+
+
+def test_running_sweeper_expires_and_prunes_views(repo):
+    ankets = fill(repo, 4)
+    for user_id in (1, 2):
+        for anket in ankets:
+            repo.mark_viewed(user_id, anket.id)
+    repo.delete_user_anket(3)
+    reported = []
+
+    async def on_expired(expired):
+        reported.extend(anket.id for anket in expired)
+
+    async def run():
+        sweeper = ExpirySweeper(repo, ttl=0.1, on_expired=on_expired, max_sleep=0.01)
+        sweeper.load()
+        # Первые анкеты уже истекли, новая истечёт через ttl
+        await asyncio.sleep(0.15)
+        sweeper.schedule(repo.add_anket(5, "https://forms.gle/5", "кино"))
+        sweeper.start()
+        await asyncio.sleep(0.03)
+        early = sorted(reported)
+        await asyncio.sleep(0.2)
+        await sweeper.stop()
+        return early
+
+    early = asyncio.run(run())
+    assert early == [1, 2, 4]
+    assert sorted(reported) == [1, 2, 4, 5]
+    assert repo.count_ankets() == 0
+    assert viewed(repo) == {}
+
+
+def test_heap_is_rebuilt_when_mostly_dead(repo):
+    fill(repo, 200)
+    sweeper = ExpirySweeper(repo, ttl=3600, on_expired=ignore, max_sleep=0.01)
+    sweeper.load()
+    for user_id in range(1, 151):
+        repo.delete_user_anket(user_id)
+
+    async def run():
+        sweeper.start()
+        await asyncio.sleep(0.05)
+        await sweeper.stop()
+
+    asyncio.run(run())
+    assert len(sweeper) == 50
+
+
+def test_prune_viewed_on_replay(tmp_path):
+    snapshot, journal = str(tmp_path / "bot_data.pkl"), str(tmp_path / "bot_data.journal")
+    repo = MemoryRepository(Storage(snapshot, journal))
+    ankets = fill(repo, 5)
+    for anket in ankets:
+        repo.mark_viewed(10, anket.id)
+    repo.mark_viewed(11, ankets[0].id)
+    repo.expire_ankets([anket.id for anket in ankets[:3]])
+    # Всё старше самой старой живой анкеты отрезано, пустые списки удалены
+    assert viewed(repo) == {10: [4, 5]}
+    repo.persistence.stop(compact=False)
+
+    # То же получается при чтении журнала с записью expire
+    storage = Storage(snapshot, journal)
+    data = storage.load()
+    storage.close()
+    assert {user_id: list(ids) for user_id, ids in data['viewed_ankets'].items()} == {10: [4, 5]}
+    assert sorted(data['ankets'].by_id) == [4, 5]
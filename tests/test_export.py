@@ -0,0 +1,62 @@
+import asyncio
+import csv
+import io
+import json
+
+from export import EXPORT_FIELDS, ExportQuery, export_ankets
+from repository import MemoryRepository
+from storage import Storage
+
+
+def collect(repo, query, **kwargs):
+    async def usernames(user_ids):
+        return {user_id: f"user{user_id}" for user_id in user_ids}
+
+    async def run():
+        parts = []
+        async for document, count in export_ankets(repo, query, usernames, **kwargs):
+            parts.append((document.read(), count))
+            document.close()
+        return parts
+    return asyncio.run(run())
+
+
+def make_repo(tmp_path, count):
+    repo = MemoryRepository(Storage(str(tmp_path / "bot_data.pkl"), str(tmp_path / "bot_data.journal")))
+    for user_id in range(1, count + 1):
+        repo.add_anket(user_id, f"https://forms.gle/{user_id}", f"Анкета номер {user_id}")
+    return repo
+
+
+def test_csv_is_split_into_parts(tmp_path):
+    repo = make_repo(tmp_path, 50)
+    parts = collect(repo, ExportQuery('csv'), batch_size=7, max_bytes=1024)
+    repo.close()
+
+    assert len(parts) > 1
+    ids = []
+    for raw, count in parts:
+        assert len(raw) <= 1024
+        rows = list(csv.reader(io.StringIO(raw.decode('utf-8-sig'))))
+        assert tuple(rows[0]) == EXPORT_FIELDS
+        assert len(rows) - 1 == count
+        ids += [int(row[0]) for row in rows[1:]]
+    assert ids == list(range(1, 51))
+
+
+def test_jsonl_single_part(tmp_path):
+    repo = make_repo(tmp_path, 5)
+    parts = collect(repo, ExportQuery('jsonl'), batch_size=2)
+    repo.close()
+
+    assert len(parts) == 1
+    raw, count = parts[0]
+    rows = [json.loads(line) for line in raw.decode('utf-8').splitlines()]
+    assert count == 5
+    assert [row['username'] for row in rows] == [f"user{i}" for i in range(1, 6)]
+
+
+def test_nothing_to_export(tmp_path):
+    repo = make_repo(tmp_path, 3)
+    assert collect(repo, ExportQuery.parse(['user=99'])) == []
+    repo.close()
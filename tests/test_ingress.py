@@ -0,0 +1,79 @@
+from ingress import FloodGuard, SqliteUpdateDedup, UpdateDedup
+
+
+def test_dedup_drops_repeated_update():
+    dedup = UpdateDedup(size=3)
+    assert dedup.check(1)
+    assert not dedup.check(1)
+    assert dedup.duplicates == 1
+    # Обновления без update_id не фильтруются
+    assert dedup.check(None)
+    assert dedup.check(None)
+
+
+def test_dedup_forgets_oldest_ids():
+    dedup = UpdateDedup(size=3)
+    for update_id in (1, 2, 3, 4):
+        assert dedup.check(update_id)
+    assert len(dedup) == 3
+    assert dedup.check(1)
+    assert not dedup.check(4)
+
+
+def test_dedup_disabled():
+    dedup = UpdateDedup(size=0)
+    assert dedup.check(1)
+    assert dedup.check(1)
+
+
+def test_sqlite_dedup_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "updates.db")
+    first, second = SqliteUpdateDedup(path), SqliteUpdateDedup(path)
+    assert first.check(10)
+    assert not second.check(10)
+    assert second.duplicates == 1
+
+
+def test_sqlite_dedup_prunes_old_ids(tmp_path):
+    dedup = SqliteUpdateDedup(str(tmp_path / "updates.db"), size=5, prune_every=10)
+    for update_id in range(1, 11):
+        assert dedup.check(update_id)
+    assert len(dedup) == 5
+
+
+def callback(user_id):
+    return {'update_id': 1, 'callback_query': {'id': '7', 'from': {'id': user_id}, 'data': 'page_1'}}
+
+
+def message(user_id, text):
+    return {'update_id': 1, 'message': {'from': {'id': user_id}, 'text': text}}
+
+
+def test_flood_guard_classify():
+    assert FloodGuard.classify(callback(5)) == ('callback', 5)
+    assert FloodGuard.classify(message(5, '/view')) == ('command', 5)
+    assert FloodGuard.classify(message(5, 'привет')) == ('text', 5)
+    assert FloodGuard.classify({'update_id': 1, 'edited_message': {}}) == (None, None)
+
+
+def test_flood_guard_limits_each_user_and_kind():
+    guard = FloodGuard({'callback': (0.001, 2), 'command': (0.001, 1), 'text': (0, 0)}, exempt=[9])
+    assert guard.allow(callback(5))
+    assert guard.allow(callback(5))
+    assert not guard.allow(callback(5))
+    assert guard.allow(callback(6))
+    assert guard.allow(message(5, '/view'))
+    assert not guard.allow(message(5, '/view'))
+    assert all(guard.allow(message(5, 'привет')) for _ in range(10))
+    assert all(guard.allow(callback(9)) for _ in range(10))
+    assert guard.throttled == {'callback': 1, 'command': 1, 'text': 0}
+
+
+def test_flood_guard_notifies_once_per_refill():
+    guard = FloodGuard({'callback': (2, 8)})
+    taps = [guard.allow(callback(5)) for _ in range(500)]
+    assert taps.count(True) == 8
+    assert sum(guard.notify(callback(5)) for _ in range(492)) == 1
+    assert guard.notify(callback(6))
+    # Без лимита сообщать не о чем
+    assert not guard.notify(message(5, 'привет'))
@@ -0,0 +1,146 @@
+import os
+import json
+import asyncio
+import tempfile
+
+import pytest
+import telegram
+
+# main настраивает лог-файл при импорте
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.mkdtemp(), 'bot.log'))
+import main  # noqa: E402
+
+
+@pytest.fixture
+def startup(monkeypatch):
+    monkeypatch.setitem(main.startup, 'status', 'starting')
+    monkeypatch.setitem(main.startup, 'phases', {})
+    monkeypatch.setattr(main, 'STARTUP_RETRY_DELAY', 0)
+    return main.startup
+
+
+class FakeQueue:
+    def __init__(self):
+        self.items = []
+
+    async def put(self, item):
+        self.items.append(item)
+
+    def qsize(self):
+        return len(self.items)
+
+
+class FakeApplication:
+    def __init__(self):
+        self.update_queue = FakeQueue()
+        self.bot = None
+
+
+def post_asgi(body: dict):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': json.dumps(body).encode()}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'path': f'/{main.TOKEN}', 'method': 'POST'}
+    asyncio.run(main.asgi_app(scope, receive, send))
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+
+@pytest.mark.parametrize("status", ['retrying', 'failed'])
+def test_webhook_refuses_updates_until_bot_is_up(monkeypatch, startup, status):
+    application = FakeApplication()
+    monkeypatch.setattr(main, 'application', application)
+    monkeypatch.setattr(main, 'event_loop', asyncio.new_event_loop())
+    startup['status'] = status
+
+    assert post_asgi({'update_id': 1}) == (503, {'status': status})
+    with main.app.test_request_context(f'/{main.TOKEN}', method='POST', json={'update_id': 2}):
+        response, code = main.webhook()
+    assert code == 503
+    assert application.update_queue.qsize() == 0
+
+
+def test_failed_startup_exits(monkeypatch, startup):
+    exits = []
+
+    def broken_storage():
+        raise ValueError("снапшот не читается")
+
+    monkeypatch.setattr(main, 'init_repo', broken_storage)
+    monkeypatch.setattr(main, 'exit_after_failed_startup', lambda: exits.append(startup['status']))
+    asyncio.run(main.warm_up())
+    assert exits == ['failed']
+
+
+def test_network_phase_is_retried(monkeypatch, startup):
+    monkeypatch.setattr(main, 'STARTUP_RETRIES', 3)
+    calls = []
+
+    async def flaky():
+        calls.append(startup['status'])
+        if len(calls) < 3:
+            raise telegram.error.NetworkError("connection refused")
+        return 'ok'
+
+    assert asyncio.run(main.retry_phase('bot', flaky)) == 'ok'
+    assert calls == ['starting', 'retrying', 'retrying']
+    assert startup['status'] == 'starting'
+
+    calls.clear()
+
+    async def down():
+        calls.append(startup['status'])
+        raise telegram.error.NetworkError("connection refused")
+
+    with pytest.raises(telegram.error.NetworkError):
+        asyncio.run(main.retry_phase('bot', down))
+    assert len(calls) == 3
+
+
+class SlowBot:
+    # answerCallbackQuery, который не успевает ответить до конца теста
+    def __init__(self):
+        self.answered = []
+        self.release = asyncio.Event()
+
+    async def answer_callback_query(self, callback_id, text=None):
+        self.answered.append(callback_id)
+        await self.release.wait()
+
+
+def tap(update_id: int, user_id: int) -> dict:
+    return {'update_id': update_id,
+            'callback_query': {'id': str(update_id), 'from': {'id': user_id}, 'data': 'page_1'}}
+
+
+def test_callback_flood_queues_constant_answers(monkeypatch):
+    application = FakeApplication()
+    application.bot = SlowBot()
+    monkeypatch.setattr(main, 'application', application)
+    monkeypatch.setattr(main, 'update_dedup', main.UpdateDedup(0))
+    monkeypatch.setattr(main, 'flood_guard', main.FloodGuard({'callback': (2, 8)}))
+    monkeypatch.setattr(main, 'FLOOD_ANSWER_LIMIT', 5)
+    monkeypatch.setattr(main, 'Update', type('Update', (), {'de_json': staticmethod(lambda data, bot: data)}))
+
+    async def flood():
+        for update_id in range(500):
+            await main.enqueue_update(tap(update_id, 5))
+        await asyncio.sleep(0)
+        one_user = (len(application.update_queue.items), len(main.flood_answers))
+        for update_id in range(500, 1500):
+            await main.enqueue_update(tap(update_id, 100 + update_id % 100))
+        await asyncio.sleep(0)
+        many_users = len(main.flood_answers)
+        application.bot.release.set()
+        await asyncio.gather(*main.flood_answers)
+        return one_user, many_users
+
+    (handled, answers), many_users = asyncio.run(flood())
+    assert handled == 8
+    assert answers == 1
+    assert many_users == 5
+    assert not main.flood_answers
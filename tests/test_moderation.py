@@ -0,0 +1,65 @@
+import pytest
+
+from moderation import BannedWordMatcher, BannedWords, normalize
+
+WORDS = ["тупая", "дура", "блять", "хер"]
+
+
+@pytest.fixture
+def matcher():
+    return BannedWordMatcher(WORDS)
+
+
+def test_normalize_joins_obfuscated_letters():
+    assert normalize("Д.у-р_а") == "дура"
+    assert normalize("д у р а") == "дура"
+    assert normalize("ДУУУУРА") == "дура"
+    assert normalize("Привет, мир") == "привет мир"
+
+
+@pytest.mark.parametrize("text", [
+    "Привет! Хочу познакомиться",
+    "Люблю процедуры в спа и прогулки",
+    "Встретимся у Эрмитажа, кто за?",
+    "Ищу компанию на выходные",
+])
+def test_clean_comments_pass(matcher, text):
+    assert matcher.find(text) is None
+
+
+@pytest.mark.parametrize("text, word", [
+    ("ты дура", "дура"),
+    ("ты ДУРА!", "дура"),
+    ("ты д.у.р.а", "дура"),
+    ("ты д у р а", "дура"),
+    ("ты дуууура", "дура"),
+    ("ты дypa", "дура"),
+    ("ты ду-ра", "дура"),
+    ("ну и дурак", "дура"),
+    ("т у п а я", "тупая"),
+    ("6лять", "блять"),
+    ("xep", "хер"),
+])
+def test_obfuscated_words_are_found(matcher, text, word):
+    assert matcher.find(text) == word
+
+
+@pytest.mark.parametrize("text", [
+    # Латиница из id формы складывается в «хер» внутри слова
+    "https://docs.google.com/forms/d/e/1FAIpQLSdXEPq8/viewform Привет",
+    "https://forms.gle/xEpA7 Привет",
+])
+def test_form_link_is_not_a_match(matcher, text):
+    url, comment = text.split(maxsplit=1)
+    assert matcher.find(comment) is None
+    assert matcher.find(text) is None
+
+
+def test_banned_words_reload(tmp_path):
+    path = tmp_path / "banned_words.txt"
+    words = BannedWords(str(path), defaults=["дура"], check_interval=0)
+    assert words.find("ты дура") == "дура"
+
+    path.write_text("# свой список\nкозёл\n", encoding="utf-8")
+    assert words.find("ты дура") is None
+    assert words.find("ты к о з е л") == "козел"
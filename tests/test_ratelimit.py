@@ -0,0 +1,174 @@
+import time
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from ratelimit import (KeyedTokenBuckets, OutboundScheduler, PRIORITY_ADMIN, PRIORITY_BACKGROUND,
+                       PRIORITY_CHANNEL, PRIORITY_USER)
+
+
+def test_burst_then_refill():
+    buckets = KeyedTokenBuckets(rate=2, capacity=3)
+    assert all(buckets.try_acquire('a', now=0) for _ in range(3))
+    assert not buckets.try_acquire('a', now=0)
+    assert buckets.delay('a', now=0) == 0.5
+    assert buckets.try_acquire('a', now=0.5)
+    assert not buckets.try_acquire('a', now=0.5)
+
+
+def test_keys_are_independent():
+    buckets = KeyedTokenBuckets(rate=1, capacity=1)
+    assert buckets.try_acquire('a', now=0)
+    assert not buckets.try_acquire('a', now=0)
+    assert buckets.try_acquire('b', now=0)
+
+
+def test_tokens_do_not_exceed_capacity():
+    buckets = KeyedTokenBuckets(rate=10, capacity=2)
+    buckets.consume('a', now=0)
+    assert all(buckets.try_acquire('a', now=100) for _ in range(2))
+    assert not buckets.try_acquire('a', now=100)
+
+
+def test_consume_can_go_into_debt():
+    # consume не проверяет остаток: ожидание растёт с каждым списанием
+    buckets = KeyedTokenBuckets(rate=1, capacity=1)
+    buckets.consume('a', now=0)
+    buckets.consume('a', now=0)
+    assert buckets.delay('a', now=0) == 2
+
+
+def test_idle_keys_are_forgotten():
+    buckets = KeyedTokenBuckets(rate=1, capacity=1, idle_ttl=10)
+    start = buckets._next_cleanup - 10
+    buckets.consume('a', now=start)
+    buckets.consume('b', now=start + 8)
+    assert len(buckets) == 2
+    buckets.consume('c', now=start + 16)
+    assert len(buckets) == 2
+    assert buckets.try_acquire('a', now=start + 16)
+
+
+# ====== OutboundScheduler ======
+def scheduler(**kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    return OutboundScheduler(**kwargs)
+
+
+class FakeRequest:
+    # Вызов make_request: сначала по очереди бросает ошибки из errors, потом отвечает
+    def __init__(self, name, log, errors=()):
+        self.name = name
+        self.log = log
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        return self._run()
+
+    async def _run(self):
+        self.calls += 1
+        self.log.append((self.name, time.monotonic()))
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.name
+
+
+def test_priority_order():
+    log = []
+
+    async def run():
+        outbound = scheduler(concurrency=1)
+        sends = [asyncio.create_task(outbound.send(chat_id, FakeRequest(name, log), priority))
+                 for chat_id, name, priority in [(1, 'background', PRIORITY_BACKGROUND),
+                                                 (2, 'admin', PRIORITY_ADMIN),
+                                                 ('@channel', 'channel', PRIORITY_CHANNEL),
+                                                 (3, 'user', PRIORITY_USER)]]
+        results = await asyncio.gather(*sends)
+        await outbound.stop()
+        return results
+
+    assert asyncio.run(run()) == ['background', 'admin', 'channel', 'user']
+    assert [name for name, _ in log] == ['user', 'channel', 'admin', 'background']
+
+
+def test_retry_after_pauses_whole_queue():
+    log = []
+
+    async def run():
+        outbound = scheduler()
+        flooded = FakeRequest('flooded', log, [RetryAfter(1)])
+        # Telegram присылает целые секунды; для теста хватит доли
+        flooded.errors[0].retry_after = 0.2
+        first = asyncio.create_task(outbound.send(1, flooded))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        other = await outbound.send(2, FakeRequest('other', log))
+        result = await first
+        await outbound.stop()
+        return started, other, result, outbound, flooded
+
+    started, other, result, outbound, flooded = asyncio.run(run())
+    assert (other, result) == ('other', 'flooded')
+    assert flooded.calls == 2
+    assert outbound.retries == 1 and outbound.sent == 2 and outbound.failed == 0
+    # Другой чат ждал конца паузы
+    other_at = next(at for name, at in log if name == 'other')
+    assert other_at - started >= 0.1
+
+
+def test_network_error_backoff():
+    log = []
+
+    async def run():
+        outbound = scheduler(max_retries=3, chat_rate=100, chat_burst=100)
+        flaky = FakeRequest('flaky', log, [NetworkError("reset"), NetworkError("reset")])
+        result = await outbound.send(1, flaky)
+        down = FakeRequest('down', log, [NetworkError("reset")] * 5)
+        with pytest.raises(NetworkError):
+            await outbound.send(2, down)
+        await outbound.stop()
+        return result, flaky, down, outbound
+
+    result, flaky, down, outbound = asyncio.run(run())
+    assert result == 'flaky' and flaky.calls == 3
+    assert down.calls == 4
+    assert outbound.retries == 5 and outbound.failed == 1
+    # Пауза между повторами растёт вдвое
+    times = [at for name, at in log if name == 'flaky']
+    assert times[2] - times[1] >= times[1] - times[0]
+
+
+@pytest.mark.parametrize("error", [BadRequest("message not found"), Forbidden("bot was blocked")])
+def test_bad_request_fails_at_once(error):
+    async def run():
+        outbound = scheduler()
+        request = FakeRequest('bad', [], [error])
+        with pytest.raises(type(error)):
+            await outbound.send(1, request)
+        await outbound.stop()
+        return request, outbound
+
+    request, outbound = asyncio.run(run())
+    assert request.calls == 1
+    assert outbound.retries == 0 and outbound.failed == 1
+
+
+def test_stop_cancels_leftovers():
+    async def run():
+        outbound = scheduler(chat_rate=0.1, chat_burst=1)
+        log = []
+        first = asyncio.create_task(outbound.send(1, FakeRequest('first', log)))
+        second = asyncio.create_task(outbound.send(1, FakeRequest('second', log)))
+        assert await first == 'first'
+        await asyncio.sleep(0.01)
+        assert outbound.qsize() == 1
+        await outbound.stop(timeout=0.05)
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        return log, outbound
+
+    log, outbound = asyncio.run(run())
+    assert [name for name, _ in log] == ['first']
+    assert outbound.qsize() == 0
@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from repository import MemoryRepository, SqliteRepository, migrate_pickle_to_sqlite
+from storage import Storage
+
+WORDS = ["кино", "книги", "котики", "кофе", "прогулки", "спорт", "музыка", "музеи", "театр", "танцы"]
+
+
+@pytest.fixture
+def repos(tmp_path):
+    memory = MemoryRepository(Storage(str(tmp_path / "bot_data.pkl"), str(tmp_path / "bot_data.journal")))
+    sqlite = SqliteRepository(str(tmp_path / "bot.db"))
+    yield memory, sqlite
+    memory.close()
+    sqlite.close()
+
+
+def fill(repos, seed=1, users=300):
+    rnd = random.Random(seed)
+    for user_id in range(1, users + 1):
+        comment = " ".join(rnd.sample(WORDS, rnd.randint(1, 4)))
+        added = [repo.add_anket(user_id, f"https://forms.gle/{user_id}", comment) for repo in repos]
+        assert added[0].id == added[1].id
+    for user_id in rnd.sample(range(1, users + 1), users // 5):
+        for repo in repos:
+            repo.delete_user_anket(user_id)
+    for _ in range(users * 3):
+        user_id, anket_id = rnd.randint(1, users), rnd.randint(1, users)
+        for repo in repos:
+            if repo.get_anket(anket_id):
+                repo.mark_viewed(user_id, anket_id)
+    return rnd
+
+
+def ids(ankets):
+    return [anket.id for anket in ankets]
+
+
+def test_search_matches_between_backends(repos):
+    memory, sqlite = repos
+    rnd = fill(repos)
+    for _ in range(500):
+        words = [word[:rnd.randint(1, len(word))] for word in rnd.sample(WORDS, rnd.randint(1, 2))]
+        user_id = rnd.choice([None, rnd.randint(1, 300)])
+        after_id = rnd.choice([0, rnd.randint(1, 300)])
+        limit = rnd.randint(1, 10)
+        assert ids(memory.search_ankets(words, limit, after_id, user_id)) == \
+            ids(sqlite.search_ankets(words, limit, after_id, user_id)), (words, user_id, after_id, limit)
+
+
+def test_pages_match_between_backends(repos):
+    memory, sqlite = repos
+    rnd = fill(repos, seed=2)
+    for _ in range(200):
+        user_id = rnd.randint(1, 300)
+        after_id = rnd.choice([0, rnd.randint(1, 300)])
+        before_id = rnd.choice([None, rnd.randint(1, 300)])
+        if before_id is not None and before_id <= after_id:
+            after_id = 0
+        assert ids(memory.unseen_ankets(user_id, 0, 5, after_id, before_id)) == \
+            ids(sqlite.unseen_ankets(user_id, 0, 5, after_id, before_id))
+        assert ids(memory.list_ankets(limit=5, after_id=after_id, before_id=before_id)) == \
+            ids(sqlite.list_ankets(limit=5, after_id=after_id, before_id=before_id))
+
+
+def test_view_of_deleted_anket_is_ignored(repos):
+    for repo in repos:
+        anket = repo.add_anket(1, "https://forms.gle/1", "кино")
+        repo.delete_user_anket(1)
+        repo.mark_viewed(2, anket.id)
+        assert repo.unseen_ankets(2, 0, 5) == []
+
+
+def test_migration_keeps_deleted_ids_retired(tmp_path):
+    snapshot, journal = str(tmp_path / "bot_data.pkl"), str(tmp_path / "bot_data.journal")
+    memory = MemoryRepository(Storage(snapshot, journal))
+    for user_id in range(1, 6):
+        memory.add_anket(user_id, f"https://forms.gle/{user_id}", "кино")
+    memory.mark_viewed(1, 2)
+    memory.delete_user_anket(4)
+    memory.delete_user_anket(5)
+    memory.close()
+
+    db_path = str(tmp_path / "bot.db")
+    assert migrate_pickle_to_sqlite(snapshot, journal, db_path) == 3
+    sqlite = SqliteRepository(db_path)
+    assert ids(sqlite.list_ankets()) == [1, 2, 3]
+    assert ids(sqlite.unseen_ankets(1, 0, 5)) == [3]
+    assert sqlite.add_anket(6, "https://forms.gle/6", "кино").id == 6
+    sqlite.close()
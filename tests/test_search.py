@@ -0,0 +1,38 @@
+from search import SearchIndex, tokenize
+
+
+def test_tokenize():
+    assert tokenize("Ищу ЁЖИКА, ежика и я!") == ["ищу", "ежика"]
+    assert tokenize("") == []
+
+
+def make_index(comments):
+    index = SearchIndex()
+    for anket_id, comment in comments.items():
+        index.add(anket_id, comment)
+    return index
+
+
+def test_prefix_and_conjunction():
+    index = make_index({1: "люблю кино и книги", 2: "кино по выходным", 3: "книги и котики"})
+    assert list(index.match(["кино"])) == [1, 2]
+    assert list(index.match(["кни"])) == [1, 3]
+    assert list(index.match(["кино", "кни"])) == [1]
+    assert list(index.match(["к"])) == [1, 2, 3]
+    assert list(index.match(["театр"])) == []
+    assert list(index.match([])) == []
+
+
+def test_match_after_cursor():
+    index = make_index({anket_id: "прогулки" for anket_id in range(1, 11)})
+    assert list(index.match(["прогулки"], after_id=7)) == [8, 9, 10]
+
+
+def test_out_of_order_add_and_remove():
+    index = make_index({5: "кофе", 2: "кофе и чай"})
+    assert list(index.match(["кофе"])) == [2, 5]
+    index.remove(2, "кофе и чай")
+    assert list(index.match(["кофе"])) == [5]
+    assert index.expand("ча") == []
+    index.remove(5, "кофе")
+    assert len(index) == 0
@@ -0,0 +1,247 @@
+import os
+import pickle
+import zlib
+
+import pytest
+
+from storage import DATA_VERSION, RECORD_HEADER, Storage, WriteBehind
+
+
+def make_storage(tmp_path, compact_every=1000):
+    return Storage(str(tmp_path / "bot_data.pkl"), str(tmp_path / "bot_data.journal"), compact_every)
+
+
+def add(anket_id, user_id):
+    return ('add_anket', anket_id, user_id, f"https://forms.gle/{anket_id}", f"Анкета {anket_id}", 1000.0 + anket_id)
+
+
+def write_journal(path, records, first_seq=1):
+    with open(path, "wb") as f:
+        for seq, record in enumerate(records, first_seq):
+            payload = pickle.dumps((seq, record))
+            f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+
+
+def filled_storage(tmp_path, count):
+    storage = make_storage(tmp_path)
+    storage.load()
+    storage.append_many([add(anket_id, anket_id * 10) for anket_id in range(1, count + 1)])
+    storage.close()
+    return storage
+
+
+class FailingJournal:
+    # Файл журнала, запись в который падает, как при переполненном диске
+    def __init__(self, journal):
+        self.journal = journal
+
+    def tell(self):
+        return self.journal.tell()
+
+    def write(self, data):
+        self.journal.write(data[:len(data) // 2])
+        self.journal.flush()
+        raise OSError("No space left on device")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.journal.close()
+
+
+def test_failed_flush_keeps_batch_and_seq(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.load()
+    persistence = WriteBehind(storage)
+    persistence.submit(add(1, 10))
+    persistence.flush()
+    assert storage.seq == 1
+
+    persistence.submit(add(2, 20))
+    persistence.submit(add(3, 30))
+    storage._journal = FailingJournal(storage._journal)
+    with pytest.raises(OSError):
+        persistence.flush()
+    assert persistence.pending() == 2
+    assert storage.seq == 1
+    assert storage.pending == 1
+
+    # Следующая запись дописывает ту же пачку с теми же номерами
+    persistence.submit(add(4, 40))
+    persistence.flush()
+    assert persistence.pending() == 0
+    assert storage.seq == 4
+    storage.close()
+
+    data = make_storage(tmp_path).load()
+    assert sorted(data['ankets'].by_id) == [1, 2, 3, 4]
+
+
+def test_unreadable_snapshot_is_not_replaced(tmp_path):
+    from repository import MemoryRepository
+
+    snapshot = tmp_path / "bot_data.pkl"
+    snapshot.write_bytes(b"not a pickle")
+    with pytest.raises(Exception):
+        MemoryRepository(make_storage(tmp_path))
+    assert snapshot.read_bytes() == b"not a pickle"
+
+
+def test_journal_replay(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.load()
+    storage.append_many([add(1, 10), add(2, 20), ('view', 20, 1), ('ban', 30)])
+    storage.append_many([('delete_user_anket', 10), ('anket_channel_post', 2, 77)])
+    storage.close()
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    assert storage.seq == 6
+    assert storage.pending == 6
+    assert list(data['ankets'].by_id) == [2]
+    assert data['ankets'].get(2).channel_message_id == 77
+    assert list(data['viewed_ankets'][20]) == [1]
+    assert data['banned_users'] == {30}
+    assert data['next_id'] == 3
+    storage.close()
+
+
+def test_corrupted_record_ends_replay(tmp_path):
+    filled_storage(tmp_path, 3)
+    journal = tmp_path / "bot_data.journal"
+    raw = bytearray(journal.read_bytes())
+    raw[-1] ^= 0xFF
+    journal.write_bytes(bytes(raw))
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    assert sorted(data['ankets'].by_id) == [1, 2]
+    assert storage.seq == 2
+    # Битая запись отрезана, новая ложится за последней целой
+    storage.append_many([add(4, 40)])
+    storage.close()
+    data = make_storage(tmp_path).load()
+    assert sorted(data['ankets'].by_id) == [1, 2, 4]
+
+
+def test_truncated_tail_is_dropped(tmp_path):
+    filled_storage(tmp_path, 3)
+    journal = tmp_path / "bot_data.journal"
+    size = journal.stat().st_size
+    with open(journal, "r+b") as f:
+        f.truncate(size - 5)
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    storage.close()
+    assert sorted(data['ankets'].by_id) == [1, 2]
+    assert journal.stat().st_size < size - 5
+
+
+def test_replay_skips_records_already_in_snapshot(tmp_path):
+    # Сбой между записью снапшота и обнулением журнала: записи до seq
+    # снапшота уже в нём и не должны примениться второй раз
+    filled_storage(tmp_path, 3)
+    storage = make_storage(tmp_path)
+    data, seq, _, _ = storage._replay()
+    storage._write_snapshot(data, seq)
+    journal = tmp_path / "bot_data.journal"
+    write_journal(journal, [add(1, 10), add(2, 20), add(3, 30), ('delete_anket', 1), add(4, 40)])
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    storage.close()
+    assert storage.seq == 5
+    assert storage.pending == 2
+    assert sorted(data['ankets'].by_id) == [2, 3, 4]
+
+
+def test_compaction(tmp_path):
+    storage = make_storage(tmp_path, compact_every=3)
+    storage.load()
+    persistence = WriteBehind(storage)
+    for anket_id in range(1, 5):
+        persistence.submit(add(anket_id, anket_id * 10))
+    persistence.flush()
+    journal = tmp_path / "bot_data.journal"
+    assert storage.pending == 0
+    assert journal.stat().st_size == 0
+
+    persistence.submit(('delete_anket', 2))
+    persistence.stop(compact=False)
+    assert storage.pending == 1
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    storage.close()
+    assert storage.seq == 5
+    assert storage.pending == 1
+    assert sorted(data['ankets'].by_id) == [1, 3, 4]
+
+
+def test_upgrade_from_version_1(tmp_path):
+    snapshot = tmp_path / "bot_data.pkl"
+    journal = tmp_path / "bot_data.journal"
+    legacy = {
+        'user_ankets': {10: {'url': 'u10', 'comment': 'первая', 'time': 100.0},
+                        20: {'url': 'u20', 'comment': 'вторая', 'time': 200.0}},
+        'ankets_list': [(10, 'u10', 'первая'), (20, 'u20', 'вторая')],
+        'viewed_ankets': {30: {0, 1}},
+        'last_post_times': {10: 100.0, 20: 200.0},
+        'channel_posts': {10: 501},
+        'banned_users': {40},
+    }
+    snapshot.write_bytes(pickle.dumps(legacy))
+    write_journal(journal, [
+        ('add_anket', 50, 'u50', 'третья', 300.0),
+        ('delete_anket_at', 1),
+        ('view', 30, 1),
+        ('channel_post', 50, 502),
+    ])
+    snapshot_bytes, journal_bytes = snapshot.read_bytes(), journal.read_bytes()
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    storage.close()
+
+    assert data['version'] == DATA_VERSION
+    ankets = data['ankets']
+    assert [(a.id, a.user_id, a.comment, a.channel_message_id) for a in ankets] == [
+        (1, 10, 'первая', 501), (2, 50, 'третья', 502)]
+    assert ankets.by_user == {10: 1, 50: 2}
+    assert data['next_id'] == 3
+    assert list(data['viewed_ankets'][30]) == [1, 2]
+    assert data['banned_users'] == {40}
+    # Исходные файлы отложены, журнал начат заново
+    assert (tmp_path / "bot_data.pkl.v1").read_bytes() == snapshot_bytes
+    assert (tmp_path / "bot_data.journal.v1").read_bytes() == journal_bytes
+    assert journal.stat().st_size == 0
+
+    reloaded = make_storage(tmp_path)
+    again = reloaded.load()
+    reloaded.close()
+    assert [tuple(a) for a in again['ankets']] == [tuple(a) for a in ankets]
+
+
+def test_upgrade_from_version_2(tmp_path):
+    snapshot = tmp_path / "bot_data.pkl"
+    v2 = {
+        'version': 2,
+        'next_id': 3,
+        'ankets_list': [(1, 10, 'u10', 'первая', 100.0), (2, 20, 'u20', 'вторая', 200.0)],
+        'user_ankets': {10: 1, 20: 2},
+        'viewed_ankets': {},
+        'banned_users': set(),
+        'last_post_times': {10: 100.0, 20: 200.0},
+        'channel_posts': {10: 501},
+    }
+    snapshot.write_bytes(pickle.dumps({'seq': 4, 'data': v2}))
+    write_journal(tmp_path / "bot_data.journal", [('channel_post', 20, 502), ('delete_user_anket', 10)], first_seq=5)
+
+    storage = make_storage(tmp_path)
+    data = storage.load()
+    storage.close()
+    assert storage.seq == 6
+    assert [(a.id, a.channel_message_id) for a in data['ankets']] == [(2, 502)]
+    assert os.path.exists(tmp_path / "bot_data.pkl.v2")